@@ -26,14 +26,27 @@ map, just subclass GeoModelAdmin, and define "options", for example::
 A complete list of options is in the olwidget documentation.
 """
 
+import json
+
+from django.conf.urls import patterns, url
 from django.contrib.admin import ModelAdmin
 from django.contrib.gis.geos import GeometryCollection
-from django.contrib.admin.options import csrf_protect_m
+from django.contrib.admin.options import (csrf_protect_m,
+        IncorrectLookupParameters)
+from django.core.exceptions import (ImproperlyConfigured, PermissionDenied,
+        ValidationError)
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.utils.encoding import force_unicode
 
-from olwidget.forms import apply_maps_to_modelform_fields, fix_initial_data, fix_cleaned_data
-from olwidget.widgets import InfoMap
-from olwidget.utils import DEFAULT_PROJ
+from olwidget import instrumentation
+from olwidget.forms import apply_maps_to_modelform_fields, BaseMapModelForm
+from olwidget.widgets import InfoMap, Map, BBoxInfoLayer
+from olwidget.utils import (DEFAULT_PROJ, SerializedEWKT,
+        transform_geometries)
+from olwidget.views import (DEFAULT_LIMIT, StreamingHttpResponse, parse_bbox,
+        filter_bbox, info_response, json_object_chunks)
 
 __all__ = ('GeoModelAdmin',)
 
@@ -42,77 +55,329 @@ class GeoModelAdmin(ModelAdmin):
     map_template = "olwidget/admin_olwidget.html"
     list_map = None
     list_map_options = None
+    # If set, the changelist map only inlines this many objects, and fetches
+    # the rest from ``changelist_map_data_view`` in chunks of this size.
+    list_map_chunk_size = None
+    # If True, list_map geometries are reprojected and serialized to WKT by
+    # the database rather than loaded as GEOS geometries.  Only supported for
+    # list_map entries that are geometry fields on the model.
+    list_map_db_serialize = False
+    # If True, the changelist map fetches only the objects in its viewport
+    # from changelist_map_bbox_view, as it is moved, up to this many.
+    list_map_bbox = False
+    list_map_bbox_limit = DEFAULT_LIMIT
+    # The most objects whose popup html changelist_map_html_view returns at
+    # once, for the server_cluster option.
+    list_map_cluster_html_limit = 100
+    # If True, the changelist map data and bbox views encode the data as it
+    # is sent, in streaming responses.
+    list_map_stream = False
     maps = None
     change_list_template = "admin/olwidget_change_list.html"
     default_field_class = None
+    # If True, form classes are built once for each set of readonly fields
+    # and get_form arguments, and reused for all requests.  Only enable this
+    # if the form fields don't depend on the request, e.g. on request.user
+    # through formfield_for_dbfield, formfield_for_foreignkey or get_form.
+    cache_forms = False
 
-    def get_form(self, *args, **kwargs):
+    def get_form(self, request, obj=None, **kwargs):
         """
-        Get a ModelForm with our own `__init__` and `clean` methods.  However,
-        we need to allow ModelForm's metaclass_factory to run unimpeded, so
-        dynamically override the methods rather than subclassing.
+        Get a ModelForm with map fields, and our own `__init__` and `clean`
+        methods.
         """
-        # Get the vanilla modelform class
-        ModelForm = super(GeoModelAdmin, self).get_form(*args, **kwargs)
+        key = None
+        if self.cache_forms:
+            key = self._get_form_cache_key(request, obj, kwargs)
+        if key is not None:
+            cached = self.__dict__.setdefault('_form_cache', {})
+            form = cached.get(key)
+            if form is None:
+                form = cached[key] = self._get_map_form(request, obj,
+                                                        **kwargs)
+            return form
+        return self._get_map_form(request, obj, **kwargs)
 
-        # enclose klass.__init__
-        orig_init = ModelForm.__init__
-        def new_init(self, *args, **kwargs):
-            orig_init(self, *args, **kwargs)
-            fix_initial_data(self.initial, self.initial_data_keymap)
+    def _get_form_cache_key(self, request, obj, kwargs):
+        """
+        Return the key of the form class for these get_form arguments, or
+        None if they can't be used as one.  Apart from ``kwargs``, ModelAdmin
+        only varies the form with the readonly fields.
+        """
+        key = (_freeze(self.get_readonly_fields(request, obj)),
+               _freeze(kwargs))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
 
-        # enclose klass.clean
-        orig_clean = ModelForm.clean
-        def new_clean(self):
-            orig_clean(self)
-            fix_cleaned_data(self.cleaned_data, self.initial_data_keymap)
-            return self.cleaned_data
+    def _get_map_form(self, request, obj=None, **kwargs):
+        # Get the vanilla modelform class
+        ModelForm = super(GeoModelAdmin, self).get_form(request, obj, **kwargs)
 
-        # Override methods
-        ModelForm.__init__ = new_init
-        ModelForm.clean = new_clean
+        # Subclass it to fix up initial and cleaned data for the maps.  The
+        # metaclass builds fields from the model again, without the admin's
+        # formfield callback, so reuse the vanilla form's fields instead.
+        MapForm = type(ModelForm)(ModelForm.__name__,
+                (BaseMapModelForm, ModelForm),
+                {'__module__': ModelForm.__module__})
+        MapForm.base_fields = ModelForm.base_fields
+        MapForm.declared_fields = ModelForm.declared_fields
 
         # Rearrange fields
-        ModelForm.initial_data_keymap = apply_maps_to_modelform_fields(
-                ModelForm.base_fields, self.maps, self.options,
+        MapForm.initial_data_keymap = apply_maps_to_modelform_fields(
+                MapForm.base_fields, self.maps, self.options,
                 self.map_template,
                 default_field_class=self.default_field_class)
-        return ModelForm
+        return MapForm
 
+    @instrumentation.instrumented("GeoModelAdmin.get_changelist_map",
+            lambda map_, self, cl, request=None: dict(
+                zip(('features', 'vertices'),
+                    map_.get_size(None) if map_ else (0, 0)),
+                options=self.list_map_options))
     def get_changelist_map(self, cl, request=None):
         """
         Display a map in the admin changelist, with info popups
         """
         if self.list_map:
-            info = []
-            if request:
-                qs = cl.get_query_set(request)
+            options = dict(self.list_map_options or {})
+            if self.list_map_bbox:
+                return Map([BBoxInfoLayer(
+                    self.get_changelist_map_data_url(request, "bbox"))],
+                    options=options)
+            qs = self.get_changelist_map_queryset(cl, request)
+            if options.get('server_cluster'):
+                # Popup html is fetched from changelist_map_html_view when a
+                # cluster is opened.
+                options.setdefault('cluster_html_url',
+                        self.get_changelist_map_data_url(request, "html"))
+                options.setdefault('cluster_html_limit',
+                        self.list_map_cluster_html_limit)
+                info = list(self.get_changelist_map_info(cl, qs, html=False))
+                return InfoMap(info, options=options)
+            if self.list_map_chunk_size:
+                # Only inline the first chunk; the rest is fetched by the
+                # browser from changelist_map_data_view.
+                objects = list(qs.order_by('pk')[:self.list_map_chunk_size])
+                if len(objects) == self.list_map_chunk_size:
+                    options['data_url'] = self.get_changelist_map_data_url(
+                            request)
+                    options['data_next'] = objects[-1].pk
             else:
-                qs = cl.get_query_set()
-            for obj in qs:
-                # Transform the fields into one projection.
-                geoms = []
-                for field in self.list_map:
-                    geom = getattr(obj, field)
-                    if geom:
-                        if callable(geom):
-                            geom = geom()
-                        geoms.append(geom)
-                for geom in geoms:
-                    geom.transform(int(DEFAULT_PROJ))
-
-                if geoms:
-                    info.append((
-                        GeometryCollection(geoms, srid=int(DEFAULT_PROJ)),
-                        "<a href='%s'>%s</a>" % (
-                            cl.url_for_result(obj),
-                            force_unicode(obj)
-                        )
-                    ))
-
-            return InfoMap(info, options=self.list_map_options)
+                objects = qs
+            info = list(self.get_changelist_map_info(cl, objects))
+            return InfoMap(info, options=options)
         return None
 
+    def get_changelist_map_queryset(self, cl, request=None):
+        if request:
+            qs = cl.get_query_set(request)
+        else:
+            qs = cl.get_query_set()
+        if self.list_map_db_serialize:
+            qs = self._db_serialize_queryset(qs)
+        return qs
+
+    def _db_serialize_queryset(self, qs):
+        """
+        Defer the ``list_map`` geometry columns, and instead select their WKT
+        in DEFAULT_PROJ as ``_olwidget_<field>`` attributes.
+        """
+        ops = connections[qs.db].ops
+        if getattr(ops, 'postgis', False):
+            as_text = 'ST_AsText'
+        elif getattr(ops, 'spatialite', False):
+            as_text = 'AsText'
+        else:
+            raise ImproperlyConfigured("list_map_db_serialize requires a "
+                    "PostGIS or SpatiaLite database.")
+        opts = self.model._meta
+        select = {}
+        for field_name in self.list_map:
+            column = "%s.%s" % (ops.quote_name(opts.db_table),
+                                ops.quote_name(opts.get_field(field_name).column))
+            select['_olwidget_%s' % field_name] = "%s(%s(%s, %s))" % (
+                    as_text, ops.transform, column, DEFAULT_PROJ)
+        return qs.defer(*self.list_map).extra(select=select)
+
+    def get_changelist_map_info(self, cl, objects, html=True):
+        """
+        Yield ``(geometry, html)`` for each object in ``objects`` which has a
+        value in any of the ``list_map`` fields.  If ``html`` is False, the
+        object's primary key is given in place of its html.
+        """
+        for obj in objects:
+            if self.list_map_db_serialize:
+                wkts = [getattr(obj, '_olwidget_%s' % field)
+                        for field in self.list_map]
+                wkts = [wkt for wkt in wkts if wkt]
+                if wkts:
+                    yield (
+                        SerializedEWKT("SRID=%s;GEOMETRYCOLLECTION(%s)" % (
+                            DEFAULT_PROJ, ",".join(wkts))),
+                        self.get_changelist_map_html(cl, obj) if html
+                                else obj.pk,
+                    )
+                continue
+
+            # Transform the fields into one projection.
+            geoms = []
+            for field in self.list_map:
+                geom = getattr(obj, field)
+                if geom:
+                    if callable(geom):
+                        geom = geom()
+                    geoms.append(geom)
+            geoms = transform_geometries(geoms, DEFAULT_PROJ)
+
+            if geoms:
+                yield (
+                    GeometryCollection(geoms, srid=int(DEFAULT_PROJ)),
+                    self.get_changelist_map_html(cl, obj) if html else obj.pk,
+                )
+
+    def get_changelist_map_html(self, cl, obj):
+        return "<a href='%s'>%s</a>" % (
+            cl.url_for_result(obj),
+            force_unicode(obj)
+        )
+
+    def get_changelist_map_data_url(self, request=None, view="data"):
+        opts = self.model._meta
+        data_url = reverse("%s:%s_%s_olwidget_map_%s" % (
+            self.admin_site.name, opts.app_label, opts.module_name, view))
+        if request and request.GET:
+            data_url += "?" + request.GET.urlencode()
+        return data_url
+
+    def changelist_map_data_view(self, request):
+        """
+        Return the next chunk of changelist map data as JSON, for objects with
+        primary keys greater than the ``after`` parameter.  The changelist's
+        filters are read from the remaining GET parameters.
+        """
+        request.GET = request.GET.copy()
+        after = request.GET.pop('after', [None])[0]
+        cl = self._get_changelist_map_cl(request)
+        if isinstance(cl, HttpResponse):
+            return cl
+        chunk_size = self.list_map_chunk_size or 500
+        qs = self.get_changelist_map_queryset(cl, request).order_by('pk')
+        if after is not None:
+            try:
+                after = self.model._meta.pk.to_python(after)
+            except ValidationError:
+                return HttpResponseBadRequest("Invalid after parameter.")
+            qs = qs.filter(pk__gt=after)
+        objects = list(qs[:chunk_size])
+
+        # Apply any simplification options as the inline map would.
+        layer = InfoMap(self.get_changelist_map_info(cl, objects),
+                options=self.list_map_options).vector_layers[0]
+        next_ = None
+        if len(objects) == chunk_size:
+            next_ = objects[-1].pk
+        content = json_object_chunks('info', layer.iter_info_json(),
+                                     {'next': next_})
+        if self.list_map_stream:
+            return StreamingHttpResponse(content,
+                                         content_type="application/json")
+        return HttpResponse("".join(content), content_type="application/json")
+
+    def changelist_map_html_view(self, request):
+        """
+        Return a JSON list of the changelist map popup html for the objects
+        whose primary keys are given, comma separated, in the ``keys``
+        parameter.  Used to open clusters with the ``server_cluster`` option.
+        At most ``list_map_cluster_html_limit`` keys are accepted.
+        """
+        request.GET = request.GET.copy()
+        keys = [key for key in request.GET.pop('keys', [''])[0].split(",")
+                if key]
+        if len(keys) > self.list_map_cluster_html_limit:
+            return HttpResponseBadRequest("Too many keys.")
+        cl = self._get_changelist_map_cl(request)
+        if isinstance(cl, HttpResponse):
+            return cl
+        pk_field = self.model._meta.pk
+        try:
+            keys = [pk_field.to_python(key) for key in keys]
+        except ValidationError:
+            return HttpResponseBadRequest("Invalid keys parameter.")
+        objects = self.get_changelist_map_queryset(cl, request).in_bulk(keys)
+        html = [self.get_changelist_map_html(cl, objects[key])
+                for key in keys if key in objects]
+        return HttpResponse(json.dumps(html), content_type="application/json")
+
+    def changelist_map_bbox_view(self, request):
+        """
+        Return the changelist map info for objects within the ``bbox``
+        parameter, for ``list_map_bbox``.
+        """
+        request.GET = request.GET.copy()
+        bbox = parse_bbox(request.GET.pop('bbox', [None])[0],
+                          request.GET.pop('srid', [None])[0])
+        zoom = request.GET.pop('zoom', [None])[0]
+        if bbox is None:
+            return HttpResponseBadRequest("Expected a bbox parameter.")
+        cl = self._get_changelist_map_cl(request)
+        if isinstance(cl, HttpResponse):
+            return cl
+        qs = filter_bbox(self.get_changelist_map_queryset(cl, request),
+                         self.list_map, bbox)
+        objects = list(qs[:self.list_map_bbox_limit + 1])
+        info = self.get_changelist_map_info(cl,
+                objects[:self.list_map_bbox_limit])
+        return info_response(info, self.list_map_options,
+                truncated=len(objects) > self.list_map_bbox_limit, zoom=zoom,
+                stream=self.list_map_stream)
+
+    def _get_changelist_map_cl(self, request):
+        """
+        Return the ChangeList for ``request``, with its filters and
+        searches applied as in the changelist view, or an error response for
+        invalid filters.  The page of results, and the counts of objects
+        which the changelist view shows, aren't queried.
+        """
+        if not self.has_change_permission(request, None):
+            raise PermissionDenied
+        list_display = self.get_list_display(request)
+        list_display_links = self.get_list_display_links(request,
+                                                         list_display)
+
+        class MapChangeList(self.get_changelist(request)):
+            def get_results(self, request):
+                pass
+
+        try:
+            return MapChangeList(request, self.model, list_display,
+                list_display_links, self.list_filter, self.date_hierarchy,
+                self.search_fields, self.list_select_related,
+                self.list_per_page, self.list_max_show_all, self.list_editable,
+                self)
+        except IncorrectLookupParameters:
+            return HttpResponseBadRequest("Invalid changelist filters.")
+
+    def get_urls(self):
+        opts = self.model._meta
+        urls = patterns('',
+            url(r'^olwidget_map_data/$',
+                self.admin_site.admin_view(self.changelist_map_data_view),
+                name="%s_%s_olwidget_map_data" % (
+                    opts.app_label, opts.module_name)),
+            url(r'^olwidget_map_bbox/$',
+                self.admin_site.admin_view(self.changelist_map_bbox_view),
+                name="%s_%s_olwidget_map_bbox" % (
+                    opts.app_label, opts.module_name)),
+            url(r'^olwidget_map_html/$',
+                self.admin_site.admin_view(self.changelist_map_html_view),
+                name="%s_%s_olwidget_map_html" % (
+                    opts.app_label, opts.module_name)),
+        )
+        return urls + super(GeoModelAdmin, self).get_urls()
+
     @csrf_protect_m
     def changelist_view(self, request, extra_context=None):
         template_response = super(GeoModelAdmin, self).changelist_view(
@@ -125,3 +390,14 @@ class GeoModelAdmin(ModelAdmin):
                 template_response.context_data['media'] += map_.media
                 template_response.context_data['map'] = map_
         return template_response
+
+def _freeze(value):
+    """
+    Return a hashable equivalent of get_form arguments built from dicts,
+    lists and tuples.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
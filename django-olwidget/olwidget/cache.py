@@ -0,0 +1,95 @@
+"""
+Render cache for olwidget maps and layers, using Django's cache framework.
+
+Caching is opt-in, by setting the ``cache_timeout`` option (in seconds) on a
+``Map`` or an ``InfoLayer``.  Keys are a hash of everything that affects the
+output: geometries, popup html, options, template and field names.  Hashing
+the data reads every geometry on each lookup; a ``cache_key`` option, such as
+a version or last-modified time of the data, replaces it.  To
+invalidate cached output explicitly, call ``invalidate()`` to expire
+everything, or ``invalidate(tag)`` to expire only widgets whose ``cache_tag``
+option is ``tag``, for example from a model's ``post_save`` signal::
+
+    from olwidget import cache
+
+    def country_saved(sender, instance, **kwargs):
+        cache.invalidate("country:%s" % instance.pk)
+"""
+import hashlib
+import json
+import time
+
+from django.utils.encoding import force_unicode
+from django.utils.functional import Promise
+
+KEY_PREFIX = "olwidget"
+
+# How long invalidation generations are kept.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+# Rendered in place of the map's html id, which is substituted when the
+# cached output is used.
+MAP_ID_PLACEHOLDER = "olwidget_cached_map_id"
+
+def make_key(tag, parts):
+    """
+    Return a cache key for the given iterable of ``parts``, which may contain
+    geometries and any JSON-serializable data.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=_json_default))
+        digest.update("\0")
+    tag_generation = 0
+    if tag is not None:
+        tag_generation = _generation(tag)
+    return "%s:%s:%s:%s" % (KEY_PREFIX, _generation(None), tag_generation,
+            digest.hexdigest())
+
+def _cache():
+    # Imported on first use, since importing it sets up the cache backend.
+    from django.core.cache import cache
+    return cache
+
+def get(key):
+    return _cache().get(key)
+
+def set(key, value, timeout):
+    _cache().set(key, value, timeout)
+
+def invalidate(tag=None):
+    """
+    Expire cached output for all widgets with the given ``cache_tag`` option,
+    or for all widgets if ``tag`` is None.
+    """
+    key = _generation_key(tag)
+    try:
+        _cache().incr(key)
+    except ValueError:
+        # Missing; a fresh generation will be started on the next lookup.
+        pass
+
+def _generation(tag):
+    key = _generation_key(tag)
+    generation = _cache().get(key)
+    if generation is None:
+        # Start from the current time rather than 0, so that entries from
+        # before an evicted generation key aren't used again.
+        _cache().add(key, int(time.time()), GENERATION_TIMEOUT)
+        generation = _cache().get(key)
+    return generation
+
+def _generation_key(tag):
+    if tag is None:
+        return "%s:generation" % KEY_PREFIX
+    return "%s:generation:%s" % (KEY_PREFIX,
+            hashlib.sha1(json.dumps(tag)).hexdigest())
+
+def _json_default(obj):
+    # Geometries, without importing GEOS to check for them.
+    if hasattr(obj, 'hexewkb'):
+        return obj.hexewkb
+    # Lazy translations.
+    if isinstance(obj, Promise):
+        return force_unicode(obj)
+    raise TypeError("%r can't be used in an olwidget cache key" % (obj,))
@@ -1,9 +1,55 @@
 from django import forms
 
-from olwidget.widgets import Map, EditableLayer, InfoLayer
+from olwidget import instrumentation, utils
+from olwidget.widgets import Map, BaseVectorLayer, EditableLayer, InfoLayer
 
 from django.contrib.gis.forms.fields import GeometryField
 
+INPUT_LIMIT_MESSAGES = {
+    'max_input_bytes': u"The geometry is too large (over %(limit)s bytes).",
+    'max_input_vertices': u"The geometry has too many vertices "
+                          u"(over %(limit)s).",
+    'max_input_components': u"The geometry has too many parts "
+                            u"(over %(limit)s).",
+    'max_input_depth': u"The geometry is nested too deeply "
+                       u"(over %(limit)s levels).",
+    'input_format': u"The geometry must be given as %(limit)s.",
+}
+
+def check_input_limits(widget, value):
+    """
+    Raise a ValidationError if ``value``, submitted from the layer
+    ``widget``, is over the ``max_input_*`` limits in the layer's (or its
+    map's) options.  This is checked before the value is parsed by GEOS.
+    """
+    if not (value and isinstance(value, basestring) and
+            isinstance(widget, BaseVectorLayer)):
+        return
+    limits = dict((name, widget.get_option(name))
+                  for name in utils.INPUT_LIMIT_OPTIONS)
+    try:
+        utils.check_input_limits(value, **limits)
+    except utils.InputLimitExceeded as e:
+        raise forms.ValidationError(
+                INPUT_LIMIT_MESSAGES[e.limit] % {'limit': e.value})
+
+def clean_layer_value(widget, value, initial):
+    """
+    Check ``value``, submitted from the layer ``widget``, against the
+    layer's input limits, and apply any changes submitted by the
+    ``delta_submit`` option to ``initial``.  Returns the value for the layer
+    field's own validation.
+    """
+    check_input_limits(widget, value)
+    if not utils.is_delta(value):
+        return value
+    try:
+        geom = utils.apply_delta(initial, value)
+    except ValueError as e:
+        raise forms.ValidationError(unicode(e))
+    # GEOS reads hex EWKB much faster than WKT.
+    return geom.hexewkb if geom else ""
+
 class MapField(forms.fields.Field):
     """
     Container field for map fields.  Similar to MultiValueField, but with
@@ -25,11 +71,42 @@ class MapField(forms.fields.Field):
                 Map(layers, options, template, layer_names))
         super(MapField, self).__init__(**kwargs)
 
+    @instrumentation.instrumented("MapField.clean",
+            lambda cleaned, self, value: dict(
+                instrumentation.measure_input(value),
+                options=self.widget.options))
     def clean(self, value):
         """
-        Return an array with the value from each layer.
+        Return an array with the value from each layer.  Changes submitted
+        by layers with the ``delta_submit`` option are applied to the field's
+        initial value.
         """
-        return [f.clean(v) for v,f in zip(value, self.fields)]
+        initial = self.initial
+        if not isinstance(initial, (list, tuple)):
+            initial = []
+        cleaned = []
+        for i, (v, f) in enumerate(zip(value, self.fields)):
+            base = initial[i] if i < len(initial) else None
+            if isinstance(f, EditableLayerField):
+                cleaned.append(f.clean(v, base))
+            else:
+                cleaned.append(f.clean(clean_layer_value(f.widget, v, base)))
+        return cleaned
+
+    def bound_data(self, data, initial):
+        """
+        Return the submitted values for redisplay, pairing the changes from
+        ``delta_submit`` layers with the geometry they apply to.
+        """
+        if not isinstance(initial, (list, tuple)):
+            initial = []
+        values = []
+        for i, v in enumerate(data):
+            if utils.is_delta(v):
+                v = utils.GeometryDelta(
+                        initial[i] if i < len(initial) else None, v)
+            values.append(v)
+        return values
 
 class EditableLayerField(GeometryField):
     """
@@ -41,6 +118,22 @@ class EditableLayerField(GeometryField):
         kwargs['widget'] = kwargs.get('widget', EditableLayer(options))
         super(EditableLayerField, self).__init__(**kwargs)
 
+    def clean(self, value, initial=None):
+        """
+        Validate ``value``.  If it holds changes from the ``delta_submit``
+        option, they are applied to ``initial`` (or the field's initial
+        value).
+        """
+        if initial is None:
+            initial = self.initial
+        value = clean_layer_value(self.widget, value, initial)
+        return super(EditableLayerField, self).clean(value)
+
+    def bound_data(self, data, initial):
+        if utils.is_delta(data):
+            return utils.GeometryDelta(initial, data)
+        return data
+
 class InfoLayerField(forms.fields.CharField):
     """
     Equivalent to:
@@ -1,8 +1,10 @@
+import threading
+
 from django import forms
 from django.contrib.gis.forms.fields import GeometryField
 
 from olwidget.widgets import Map, BaseVectorLayer, EditableLayer
-from olwidget.fields import MapField
+from olwidget.fields import MapField, EditableLayerField
 from olwidget import utils
 
 __all__ = ('MapModelForm', )
@@ -25,6 +27,7 @@ class BaseMapModelForm(forms.models.BaseModelForm):
     def __init__(self, *args, **kwargs):
         super(BaseMapModelForm, self).__init__(*args, **kwargs)
         fix_initial_data(self.initial, self.initial_data_keymap)
+        set_map_initial(self.fields, self.initial)
 
     def clean(self):
         super(BaseMapModelForm, self).clean()
@@ -40,11 +43,31 @@ class MapModelFormOptions(forms.models.ModelFormOptions):
         self.default_field_class = getattr(options, 'default_field_class', None)
         self.template = getattr(options, 'template', None)
 
+# Held while building the fields of a MapModelForm class.
+_build_lock = threading.RLock()
+
+class LazyFormFields(object):
+    """
+    Stands in for ``base_fields`` or ``initial_data_keymap`` of a
+    MapModelForm class until either is first used, by the class or by an
+    instance, then builds the class's fields and is replaced by them.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        owner.build_fields()
+        return getattr(owner, self.name)
+
 class MapModelFormMetaclass(type):
     """ 
     Metaclass for map-containing ModelForm widgets.  The implementation is
     mostly copied from django's ModelFormMetaclass, but we change the
     hard-coded parent class name and add our map field processing parts.
+
+    Building the fields and their map widgets is deferred until the form is
+    first instantiated or its ``base_fields`` are used, so that defining
+    forms which aren't used costs little.
     """
     def __new__(mcs, name, bases, attrs):
         formfield_callback = attrs.pop('formfield_callback',
@@ -62,30 +85,49 @@ class MapModelFormMetaclass(type):
 
         if 'media' not in attrs:
             new_class.media = forms.widgets.media_property(new_class)
-        opts = new_class._meta = MapModelFormOptions(
+        new_class._meta = MapModelFormOptions(
                 getattr(new_class, 'Meta', None))
-        if opts.model:
-            # If a model is defined, extract form fields from it.
-            fields = forms.models.fields_for_model(opts.model, opts.fields,
-                                      opts.exclude, opts.widgets, 
-                                      formfield_callback)
-
-            # Override default model fields with any custom declared ones
-            # (plus, include all the other declared fields).
-            fields.update(declared_fields)
-        else:
-            fields = declared_fields
-
-        # Transform base fields by extracting types mentioned in 'maps'
-        initial_data_keymap = apply_maps_to_modelform_fields(
-                fields, opts.maps, default_field_class=opts.default_field_class,
-                default_template=opts.template)
-
-        new_class.initial_data_keymap = initial_data_keymap
         new_class.declared_fields = declared_fields
-        new_class.base_fields = fields
+        new_class._formfield_callback = staticmethod(formfield_callback)
+        new_class.base_fields = LazyFormFields('base_fields')
+        new_class.initial_data_keymap = LazyFormFields('initial_data_keymap')
         return new_class
 
+    def build_fields(cls):
+        """
+        Build the form's ``base_fields`` and ``initial_data_keymap``, unless
+        they have been already.
+        """
+        with _build_lock:
+            lazy = [name for name in ('base_fields', 'initial_data_keymap')
+                    if isinstance(cls.__dict__.get(name), LazyFormFields)]
+            if not lazy:
+                return
+            opts = cls._meta
+            declared_fields = cls.declared_fields
+            if opts.model:
+                # If a model is defined, extract form fields from it.
+                fields = forms.models.fields_for_model(opts.model,
+                        opts.fields, opts.exclude, opts.widgets,
+                        cls._formfield_callback)
+
+                # Override default model fields with any custom declared ones
+                # (plus, include all the other declared fields).
+                fields.update(declared_fields)
+            else:
+                fields = declared_fields
+
+            # Transform base fields by extracting types mentioned in 'maps'
+            initial_data_keymap = apply_maps_to_modelform_fields(
+                    fields, opts.maps,
+                    default_field_class=opts.default_field_class,
+                    default_template=opts.template)
+
+            built = {'base_fields': fields,
+                     'initial_data_keymap': initial_data_keymap}
+            for name in lazy:
+                setattr(cls, name, built[name])
+
 class MapModelForm(BaseMapModelForm):
     __metaclass__ = MapModelFormMetaclass
 
@@ -106,6 +148,17 @@ def fix_initial_data(initial, initial_data_keymap):
             initial[dest] = data
     return initial
 
+def set_map_initial(fields, initial):
+    """
+    Give each map field in ``fields`` its value from the form's ``initial``
+    data, which changes submitted by layers with the ``delta_submit`` option
+    are applied to.  ``fields`` should be the form instance's own copies.
+    """
+    for name, field in fields.iteritems():
+        if (isinstance(field, (MapField, EditableLayerField)) and
+                initial.get(name) is not None):
+            field.initial = initial[name]
+
 def fix_cleaned_data(cleaned_data, initial_data_keymap):
     for group, keys in initial_data_keymap.iteritems():
         if cleaned_data.has_key(group):
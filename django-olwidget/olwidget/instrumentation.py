@@ -0,0 +1,189 @@
+"""
+Timing and size events for olwidget's rendering and form handling.
+
+A collector is any callable taking an ``Event``.  Events are emitted for
+``Map.render``, the ``prepare`` of each layer, ``MapField.clean``,
+``Map._has_changed`` and ``GeoModelAdmin.get_changelist_map``, but only
+while a collector is registered; otherwise these only check an empty list.
+``PercentileCollector`` aggregates the events for each view, which it learns
+from ``ViewNameMiddleware``::
+
+    # settings.py
+    MIDDLEWARE_CLASSES += ('olwidget.instrumentation.ViewNameMiddleware',)
+
+    # urls.py, or anywhere imported at startup
+    from olwidget import instrumentation
+    map_stats = instrumentation.PercentileCollector()
+    instrumentation.add_collector(map_stats)
+
+    # Later, e.g. in a management command or a staff-only view:
+    for row in map_stats.report():
+        print row
+"""
+import collections
+import functools
+import threading
+import timeit
+
+# Registered collectors.  Instrumented code skips all measurement while this
+# is empty.
+collectors = []
+
+timer = timeit.default_timer
+
+_state = threading.local()
+
+class Event(object):
+    """
+    A measurement of one call.  Sizes which don't apply to the call are
+    None: ``features`` and ``vertices`` count the geometries handled (with
+    vertices estimated for geometries which haven't been parsed),
+    ``input_bytes`` the size of submitted values, and ``output_bytes`` that
+    of rendered output.  ``view`` is the name of the current view, if
+    ``ViewNameMiddleware`` is installed.
+    """
+    def __init__(self, name, milliseconds, features=None, vertices=None,
+            input_bytes=None, output_bytes=None, options=None, view=None):
+        self.name = name
+        self.milliseconds = milliseconds
+        self.features = features
+        self.vertices = vertices
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.options = options
+        self.view = view
+
+    def __repr__(self):
+        return "<Event %s %.3fms in %s>" % (self.name, self.milliseconds,
+                                            self.view)
+
+def add_collector(collector):
+    collectors.append(collector)
+
+def remove_collector(collector):
+    collectors.remove(collector)
+
+def emit(name, start, **sizes):
+    """
+    Send an event for a call to ``name`` begun at ``start`` (a ``timer()``
+    value) to the collectors.  ``sizes`` are the ``Event``'s other fields.
+    """
+    event = Event(name, (timer() - start) * 1000,
+                  view=getattr(_state, 'view', None), **sizes)
+    for collector in list(collectors):
+        collector(event)
+
+def instrumented(name, measure=None):
+    """
+    Decorator emitting an event for each call while collectors are
+    registered.  ``measure`` is called with the result followed by the
+    call's arguments, and returns a dict of the event's sizes.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not collectors:
+                return func(*args, **kwargs)
+            start = timer()
+            result = func(*args, **kwargs)
+            sizes = {}
+            if measure is not None:
+                sizes = measure(result, *args, **kwargs)
+            emit(name, start, **sizes)
+            return result
+        return wrapper
+    return decorator
+
+def measure_geometries(geometries):
+    """
+    Return ``(features, vertices)`` for an iterable of geometries and (E)WKT
+    strings.  Vertices in strings are estimated from their commas rather
+    than parsed.
+    """
+    features = vertices = 0
+    for geom in geometries:
+        if not geom:
+            continue
+        features += 1
+        if isinstance(geom, basestring):
+            vertices += geom.count(",") + 1
+        elif hasattr(geom, 'num_coords'):
+            vertices += geom.num_coords
+    return (features, vertices)
+
+def measure_input(values):
+    """ Return the sizes of a list of submitted layer values. """
+    values = [v for v in values or [] if isinstance(v, basestring)]
+    features, vertices = measure_geometries(values)
+    return {'features': features, 'vertices': vertices,
+            'input_bytes': sum(len(v) for v in values)}
+
+class ViewNameMiddleware(object):
+    """
+    Records the name of the view handling each request, for the ``view`` of
+    events.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _state.view = "%s.%s" % (view_func.__module__,
+                getattr(view_func, '__name__', view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        _state.view = None
+        return response
+
+class PercentileCollector(object):
+    """
+    Collects events for each view and event name, keeping the most recent
+    ``max_samples`` of each, and reports percentiles of their times and
+    sizes.
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event.view, event.name)
+        with self.lock:
+            events = self.events.get(key)
+            if events is None:
+                events = self.events[key] = collections.deque(
+                        maxlen=self.max_samples)
+            events.append(event)
+
+    def percentiles(self, name, view=None, field='milliseconds',
+            percentiles=(50, 90, 99)):
+        """
+        Return a dict of the given percentiles of the event attribute
+        ``field`` for events called ``name`` in ``view``, or None if there
+        are no such events.
+        """
+        with self.lock:
+            events = list(self.events.get((view, name), ()))
+        values = sorted(getattr(e, field) for e in events
+                        if getattr(e, field) is not None)
+        if not values:
+            return None
+        return dict((p, values[min(len(values) - 1,
+                                   int(len(values) * p / 100.0))])
+                    for p in percentiles)
+
+    def report(self, percentiles=(50, 90, 99)):
+        """
+        Return a list of ``(view, name, count, times)`` for everything
+        collected, where ``times`` is a dict of time percentiles in
+        milliseconds, slowest first by the last percentile.
+        """
+        with self.lock:
+            keys = [(key, len(events)) for key, events in self.events.items()]
+        rows = []
+        for (view, name), count in keys:
+            times = self.percentiles(name, view, percentiles=percentiles)
+            if times is not None:
+                rows.append((view, name, count, times))
+        rows.sort(key=lambda row: row[3][percentiles[-1]], reverse=True)
+        return rows
+
+    def reset(self):
+        with self.lock:
+            self.events = {}
@@ -1,12 +1,22 @@
+import copy
+import json
+import subprocess
+import sys
+
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from django import forms
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import (GeometryCollection, LineString,
+        MultiPoint, Point)
 
 from olwidget.fields import MapField, EditableLayerField, InfoLayerField
-from olwidget.widgets import EditableMap, InfoMap
-from olwidget.forms import MapModelForm
+from olwidget.widgets import EditableMap, EditableLayer, InfoMap, InfoLayer, ColumnarInfoLayer, Map
+from olwidget.widgets import MapDisplay, STREAM_CHUNK_SIZE
+from olwidget import cache, instrumentation
+from olwidget.forms import MapModelForm, LazyFormFields
+from olwidget import utils
 
 
 # Simple geo model for testing
@@ -139,6 +149,23 @@ class TestForm(TestCase):
         form = MyModelForm()
         unicode(form)
 
+    def test_modelform_lazy_fields(self):
+        class LazyForm(MapModelForm):
+            class Meta:
+                model = MyModel
+                maps = ((('start', 'end'), None),)
+        self.assertTrue(isinstance(LazyForm.__dict__['base_fields'],
+                                   LazyFormFields))
+        form = LazyForm()
+        self.assertEqual(form.fields.keys(),
+                         ['koan', 'start_end', 'love', 'route', 'death'])
+        # Geometry fields which aren't in ``maps``, like route, are left as
+        # they are.
+        self.assertEqual(form.initial_data_keymap,
+                         {'start_end': ['start', 'end']})
+        self.assertFalse(isinstance(LazyForm.__dict__['base_fields'],
+                                    LazyFormFields))
+
     def test_modelform_valid(self):
         form = MyModelForm({'start': "SRID=4326;POINT(0 0)", 
             'route': "SRID=4326;LINESTRING(0 0,1 1)"})
@@ -235,6 +262,82 @@ class TestForm(TestCase):
         })
         self.assertTrue(form.is_valid())
 
+    def test_input_limits(self):
+        field = EditableLayerField({'max_input_vertices': 3})
+        self.assertTrue(field.clean("SRID=4326;LINESTRING(0 0,1 1,2 2)"))
+        self.assertRaises(forms.ValidationError, field.clean,
+                "SRID=4326;LINESTRING(0 0,1 1,2 2,3 3)")
+
+        # Limits from the map's options apply to model form fields.
+        class LimitedForm(MapModelForm):
+            class Meta:
+                model = MyModel
+                maps = ((('start', 'route'), {'max_input_bytes': 30}),)
+        form = LimitedForm({'start': "SRID=4326;POINT(0 0)",
+                            'route': "SRID=4326;LINESTRING(0 0,1 1,2 2,3 3)"})
+        self.assertFalse(form.is_valid())
+        self.assertTrue('start_route' in form.errors)
+
+        self.assertRaises(utils.InputLimitExceeded, utils.check_input_limits,
+                "MULTIPOINT((0 0),(1 1))", max_input_components=2)
+        self.assertRaises(utils.InputLimitExceeded, utils.check_input_limits,
+                "GEOMETRYCOLLECTION(MULTIPOLYGON(((0 0,1 1,0 1,0 0))))",
+                max_input_depth=2)
+        utils.check_input_limits("MULTIPOINT((0 0),(1 1))",
+                max_input_vertices=2, max_input_depth=2)
+
+        # Input which can't be scanned isn't accepted with structural limits.
+        line = LineString((0, 0), (1, 1), (2, 2), (3, 3), srid=4326)
+        self.assertRaises(forms.ValidationError, field.clean, line.hexewkb)
+        self.assertRaises(forms.ValidationError, field.clean, line.json)
+        self.assertTrue(EditableLayerField({'max_input_bytes': 1000}).clean(
+                line.hexewkb))
+
+    def test_delta_submit(self):
+        base = "SRID=4326;MULTIPOINT((0 0),(1 1),(2 2))"
+        options = {'geometry': 'point', 'is_collection': True,
+                   'delta_submit': True}
+        field = EditableLayerField(options, initial=base)
+        digest = utils.geometry_digest(base)
+        changes = {'srid': 4326, 'type': 'MULTIPOINT', 'base': digest,
+                   'size': 3, 'modified': {'1': 'POINT (5 5)'},
+                   'added': ['POINT (6 6)'], 'deleted': [0]}
+        delta = utils.DELTA_PREFIX + json.dumps(changes)
+        geom = field.clean(delta)
+        self.assertEqual(geom.coords, ((5, 5), (2, 2), (6, 6)))
+        self.assertTrue(utils.geometry_changed(base, delta))
+        self.assertTrue(digest in EditableLayer(options).render("geom", base))
+
+        unchanged = utils.DELTA_PREFIX + json.dumps({
+            'srid': 4326, 'base': digest, 'size': 3})
+        self.assertEqual(field.clean(unchanged).coords,
+                         ((0, 0), (1, 1), (2, 2)))
+        self.assertFalse(utils.geometry_changed(base, unchanged))
+
+        # Changes made to a different version of the geometry are rejected,
+        # even if it has as many components.
+        self.assertRaises(forms.ValidationError, field.clean, delta,
+                initial="SRID=4326;MULTIPOINT((0 0),(1 1),(3 3))")
+        changes['size'] = 4
+        self.assertRaises(forms.ValidationError, field.clean,
+                utils.DELTA_PREFIX + json.dumps(changes))
+
+        # Unedited components are kept in the base geometry's projection.
+        mercator = Point(1, 1, srid=4326)
+        mercator.transform(900913)
+        base = MultiPoint(Point(0, 0, srid=900913), mercator, srid=900913)
+        delta = utils.DELTA_PREFIX + json.dumps({
+            'srid': 4326, 'base': utils.geometry_digest(base), 'size': 2,
+            'added': ['POINT (2 2)']})
+        geom = utils.apply_delta(base, delta)
+        self.assertEqual(geom.srid, 900913)
+        self.assertEqual(geom[1].coords, mercator.coords)
+
+        # Redisplayed changes are rendered along with their base geometry.
+        html = Map([EditableLayer(options)]).render("geom",
+                [utils.GeometryDelta(base, delta)])
+        self.assertTrue("deltaBase" in html)
+
     def test_custom_template_map_model_form(self):
         form = CustomTemplateMapModelForm()
         for field in ('start', 'route', 'end'):
@@ -246,3 +349,414 @@ class TestForm(TestCase):
             self.assertEquals(unicode(form[field]), u'<h1>Boogah!</h1>\n')
         self.assertNotEquals(unicode(form['route']), u'<h1>Boogah!</h1>\n')
 
+
+def decode_polyline(value, precision=utils.POLYLINE_PRECISION):
+    values = []
+    index = 0
+    while index < len(value):
+        result = shift = 0
+        while True:
+            byte = ord(value[index]) - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if byte < 0x20:
+                break
+        values.append(~(result >> 1) if result & 1 else result >> 1)
+    coords = []
+    x = y = 0
+    for i in range(0, len(values), 2):
+        x += values[i]
+        y += values[i + 1]
+        coords.append([float(x) / 10 ** precision, float(y) / 10 ** precision])
+    return coords
+
+def decode_polyline_geometry(geom):
+    if geom['type'] == 'GeometryCollection':
+        return {'type': geom['type'], 'geometries': [
+            decode_polyline_geometry(g) for g in geom['geometries']]}
+    def decode(coords):
+        if isinstance(coords, basestring):
+            return decode_polyline(coords)
+        return [decode(c) for c in coords]
+    coordinates = decode(geom['coordinates'])
+    if geom['type'] == 'Point':
+        coordinates = coordinates[0]
+    return {'type': geom['type'], 'coordinates': coordinates}
+
+class TestUtils(TestCase):
+    def test_get_ewkt(self):
+        # Only EWKT serialized by the database is passed through unparsed.
+        self.assertEqual(utils.get_ewkt(
+                utils.SerializedEWKT("SRID=4326;POINT (1 2)")),
+                "SRID=4326;POINT (1 2)")
+        self.assertEqual(utils.get_geos(utils.get_ewkt("SRID=4326;POINT(1 2)")),
+                Point(1, 2, srid=4326))
+        self.assertEqual(utils.get_ewkt("SRID=4326;POINT(1 2)"),
+                utils.get_ewkt(Point(1, 2, srid=4326)))
+        self.assertEqual(utils.get_geos(utils.get_ewkt(Point(1, 2, srid=4326))),
+                Point(1, 2, srid=4326))
+        self.assertEqual(utils.get_ewkt(""), "")
+
+    def test_simplify(self):
+        # A circle-ish polygon with many vertices.
+        circle = Point(0, 0, srid=4326).buffer(1, quadsegs=256)
+        self.assertTrue(circle.num_coords > 1000)
+        self.assertTrue(utils.simplify(circle, 0.1).num_coords < 100)
+        self.assertTrue(utils.simplify(circle, None, 50).num_coords <= 50)
+
+        layer = InfoLayer([[circle, "circle"]], {'simplify': True,
+                                                 'max_vertices': 100})
+        js = layer.render("layer", None)
+        self.assertFalse('simplify' in js)
+        before, after = layer.vertex_counts
+        self.assertEqual(before, circle.num_coords)
+        self.assertTrue(after <= 100)
+
+    def test_map_display_empty(self):
+        display = MapDisplay([None, ""], {'simplify': True})
+        self.assertEqual(display.wkt, "")
+        self.assertEqual(display.vertex_counts, None)
+        unicode(display)
+
+    def test_encode_geometry(self):
+        self.assertEqual(utils.encode_polyline(
+                [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]),
+                "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        point = Point(1.123456789, 2, srid=4326)
+        self.assertEqual(utils.encode_geometry(point, 'geojson', 3),
+                {'type': 'Point', 'coordinates': [1.123, 2.0]})
+        self.assertEqual(utils.encode_geometry(point, 'polyline'),
+                {'type': 'Point', 'coordinates': utils.encode_polyline(
+                    [(1.12346, 2)])})
+        self.assertRaises(ValueError, utils.encode_geometry, point, 'kml')
+
+        # Polyline encoded geometries decode to their GeoJSON, as in
+        # olwidget.js's decodePolylineGeometry.
+        for geom in (MultiPoint(Point(0, 0), Point(1.5, -2)),
+                     GeometryCollection(MultiPoint(Point(0, 0), Point(1, 1)),
+                                        Point(2, 3),
+                                        LineString((0, 0), (1, 2)))):
+            geom.srid = 4326
+            self.assertEqual(
+                    decode_polyline_geometry(
+                        utils.encode_geometry(geom, 'polyline')),
+                    utils.encode_geometry(geom, 'geojson'))
+
+        layer = InfoLayer([[point, "point"]], {'geometry_encoding': 'geojson'})
+        self.assertTrue('"geometryEncoding": "geojson"' in layer.render("a", None))
+
+    def test_options_json(self):
+        options = {'overlay_style': {'fill_color': '#ffffff'}}
+        memo = utils.OptionsJSON()
+        self.assertEqual(memo.encode(options),
+                '{"overlayStyle": {"fillColor": "#ffffff"}}')
+        first = memo.memo
+        memo.encode(options)
+        self.assertTrue(memo.memo is first)
+        options['overlay_style']['fill_color'] = '#000000'
+        self.assertEqual(memo.encode(options),
+                '{"overlayStyle": {"fillColor": "#000000"}}')
+
+    def test_precision(self):
+        point = Point(1.123456789, -2.5, srid=4326)
+        self.assertEqual(utils.get_ewkt(point, precision=3),
+                "SRID=4326;POINT (1.123 -2.5)")
+        self.assertEqual(utils.collection_ewkt([point, point], precision=1),
+                "SRID=4326;GEOMETRYCOLLECTION(POINT (1.1 -2.5),POINT (1.1 -2.5))")
+
+        mymap = InfoMap([[point, "point"]], {'precision': 2})
+        self.assertTrue("POINT (1.12 -2.5)" in unicode(mymap))
+
+        # Precision is in decimal places, even for large coordinates.
+        line = LineString((-122.4194157, 37.7749), (-13627361.5, 0), srid=4326)
+        self.assertEqual(utils.write_wkt(line, 6),
+                "LINESTRING (-122.419416 37.7749, -13627361.5 0)")
+
+    def test_geometry_changed(self):
+        point = Point(1, 2, srid=4326)
+        self.assertFalse(utils.geometry_changed(None, ""))
+        self.assertTrue(utils.geometry_changed(point, ""))
+        self.assertFalse(utils.geometry_changed(point,
+                utils.get_ewkt(point).replace(" ", "  ")))
+        self.assertFalse(utils.geometry_changed(point, "POINT(1 2)"))
+        self.assertTrue(utils.geometry_changed(point, "POINT(1 2.001)"))
+        self.assertFalse(utils.geometry_changed(point, "POINT(1 2.001)",
+                tolerance=0.01))
+        self.assertTrue(utils.geometry_changed(point, "LINESTRING(1 2,1 2)"))
+
+        mymap = EditableMap({'change_tolerance': 0.01})
+        self.assertFalse(mymap._has_changed([point], ["POINT(1 2.001)"]))
+
+    def test_transform(self):
+        point = Point(10, 10, srid=900913)
+        transformed = utils.get_geos(point)
+        self.assertEqual(transformed.srid, 4326)
+        # The caller's geometry is left alone.
+        self.assertEqual(point.srid, 900913)
+        self.assertEqual(point.coords, (10, 10))
+        self.assertTrue(utils.get_transform(900913, 4326) is
+                utils.get_transform("900913", "4326"))
+        self.assertTrue(utils.transform(transformed, 4326) is transformed)
+
+    def test_lazy_info(self):
+        calls = []
+        def info():
+            calls.append(None)
+            return ([Point(i, i, srid=4326), "Point %i" % i] for i in range(3))
+        field = InfoLayerField(info)
+        self.assertEqual(calls, [])
+        js = field.widget.render("layer", None)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue("Point 2" in js)
+
+        generated = ([Point(0, 0, srid=4326), "Once"] for i in range(1))
+        self.assertTrue("Once" in InfoLayer(generated).render("layer", None))
+
+    def test_columnar_info(self):
+        x, y = utils.transform_coordinates([0, 10], [0, 20], 4326, 900913)
+        self.assertAlmostEqual(x[1], 1113194.9, 1)
+        self.assertAlmostEqual(y[1], 2273030.9, 1)
+        x, y = utils.transform_coordinates(x, y, 900913, 4326)
+        self.assertAlmostEqual(y[1], 20)
+
+        layer = ColumnarInfoLayer([0, 10], [0, 20], ["a", "b"],
+                options={'precision': 1})
+        Map([layer])
+        data = layer.get_info_array()
+        self.assertEqual(data['srid'], 900913)
+        self.assertEqual(data['x'], [0.0, 1113194.9])
+        self.assertEqual(data['html'], ["a", "b"])
+        self.assertFalse('offsets' in data)
+        self.assertTrue('"html": ["a", "b"]' in Map([layer]).render(
+                "map", None))
+
+    def test_server_cluster(self):
+        order, levels = utils.grid_clusters([0, 10, 5000000], [0, 10, 0],
+                max_zoom=10)
+        self.assertEqual(order[2], 2)
+        self.assertEqual([c[2] for c in levels[0]], [2, 1])
+        self.assertEqual(levels[0][0][:2], (5, 5))
+        self.assertEqual([c[2] for c in levels[-1]], [2, 1])
+
+        layer = InfoLayer([[Point(0, 0, srid=4326), "a"],
+                           [Point(0, 0.001, srid=4326), "b"],
+                           [Point(40, 0, srid=4326), "c"]],
+                          {'server_cluster': True})
+        data = layer.get_info_array()
+        self.assertEqual(data['zooms'][0]['count'], [2, 1])
+        self.assertEqual(data['zooms'][-1]['count'], [1, 1, 1])
+        self.assertEqual(sorted(data['html'][:2]), ["a", "b"])
+        self.assertEqual(data['html'][2], "c")
+
+    def test_tile_bounds(self):
+        extent = utils.MERCATOR_MAX_EXTENT
+        self.assertEqual(utils.tile_bounds(0, 0, 0),
+                (-extent, -extent, extent, extent))
+        self.assertEqual(utils.tile_bounds(1, 1, 0), (0, 0, extent, extent))
+        self.assertEqual(utils.tile_bounds(1, 0, 1), (-extent, -extent, 0, 0))
+
+class TestCopy(TestCase):
+    def test_deepcopy(self):
+        info = [[Point(0, 0, srid=4326), "a"]]
+        map_ = Map([InfoLayer(info), EditableLayer()], {'name': 'map'})
+        copied = copy.deepcopy(map_)
+        layer = copied.vector_layers[0]
+        self.assertTrue(layer.info is info)
+        self.assertTrue(layer.options is not map_.vector_layers[0].options)
+        self.assertTrue(layer.map_options is copied.options)
+        self.assertEqual(copied.vector_layers.editable,
+                         [copied.vector_layers[1]])
+
+        # Rendering leaves the widgets unchanged.
+        output = copied.render("geom", None, {'id': 'id_geom'})
+        self.assertTrue('"name": "Geom 0"' in output)
+        self.assertEqual(layer.options, {})
+        self.assertEqual(copied.vector_layers[1].options, {})
+        self.assertEqual(copied.layer_names, None)
+
+class TestStream(TestCase):
+    def test_stream(self):
+        info = [[Point(i, 0, srid=4326), "</script>%i" % i]
+                for i in range(STREAM_CHUNK_SIZE + 1)]
+        for options in ({}, {'bootstrap': True}):
+            map_ = Map([InfoLayer(info), EditableLayer()], options)
+            chunks = list(map_.stream("geom", [None], {'id': 'id_geom'}))
+            self.assertTrue(len(chunks) > 3)
+            self.assertEqual("".join(chunks),
+                    map_.render("geom", [None], {'id': 'id_geom'}))
+
+        # Content which looks like a placeholder is left alone.
+        map_ = Map([InfoLayer([[Point(0, 0, srid=4326),
+                                "olwidget_stream_0 olwidget_stream_info"]])])
+        self.assertEqual("".join(map_.stream("map", None, {'id': 'id_map'})),
+                         map_.render("map", None, {'id': 'id_map'}))
+
+        layer = InfoLayer(info)
+        self.assertEqual(json.loads("".join(layer.iter_info_json())),
+                         layer.get_info_array())
+        self.assertEqual("".join(InfoLayer([]).iter_info_json()), "[]")
+
+class TestRenderCache(TestCase):
+    def test_map_cache(self):
+        info = [[Point(0, 0, srid=4326), "that"]]
+        options = {'cache_timeout': 60, 'cache_tag': 'test'}
+        first = InfoMap(info, options).render("map", None, {'id': 'first_id'})
+        self.assertTrue('id="first_id"' in first)
+        self.assertFalse('cache' in first)
+
+        # Same data, different id: served from the cache.
+        key = cache.make_key('test', InfoMap(info, options).get_cache_parts(
+                "map", None))
+        self.assertNotEqual(cache.get(key), None)
+        second = InfoMap(info, options).render("map", None, {'id': 'second_id'})
+        self.assertEqual(first.replace('first_id', 'second_id'), second)
+
+        # Different data isn't.
+        other = InfoMap([[Point(1, 1, srid=4326), "that"]], options)
+        self.assertNotEqual(cache.make_key('test',
+                other.get_cache_parts("map", None)), key)
+
+        cache.invalidate('test')
+        self.assertEqual(cache.get(cache.make_key('test',
+                InfoMap(info, options).get_cache_parts("map", None))), None)
+
+    def test_cache_key(self):
+        options = {'cache_timeout': 60, 'cache_key': 'v1'}
+        first = InfoMap([[Point(0, 0, srid=4326), "this"]], options).render(
+                "map", None, {'id': 'map_id'})
+
+        # The data isn't read: output for the same key is served as is.
+        def info():
+            raise AssertionError("cache_key data was read")
+        self.assertEqual(InfoMap(info, options).render(
+                "map", None, {'id': 'map_id'}), first)
+        layer = InfoLayer([[Point(0, 0, srid=4326), "this"]], options)
+        self.assertEqual(layer.prepare("layer", None),
+                InfoLayer(info, options).prepare("layer", None))
+
+        changed = InfoMap([[Point(1, 1, srid=4326), "that"]],
+                dict(options, cache_key='v2')).render(
+                "map", None, {'id': 'map_id'})
+        self.assertNotEqual(changed, first)
+        self.assertTrue('that' in changed)
+
+    def test_lazy_info(self):
+        calls = []
+        def info():
+            calls.append(1)
+            return [[Point(0, 0, srid=4326), "this"]]
+
+        # Without a cache_key, lazy info is read once, to render it.
+        options = {'cache_timeout': 60}
+        for i in range(2):
+            output = InfoMap(info, options).render("map", None)
+            self.assertTrue('this' in output)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(len(list(InfoMap(info, options).stream(
+                "map", None))) > 1)
+        self.assertEqual(len(calls), 3)
+
+        # With one, it's read once to fill the cache.
+        options['cache_key'] = 'lazy'
+        for i in range(2):
+            InfoMap(info, options).render("map", None)
+        self.assertEqual(len(calls), 4)
+
+    def test_unserializable_part(self):
+        self.assertRaises(TypeError, cache.make_key, None, [object()])
+
+class TestInstrumentation(TestCase):
+    def test_events(self):
+        collector = instrumentation.PercentileCollector()
+        instrumentation.add_collector(collector)
+        try:
+            Map([InfoLayer([["SRID=4326;LINESTRING(0 0,1 1)", "a"]])]).render(
+                    "map", None)
+        finally:
+            instrumentation.remove_collector(collector)
+        names = [name for view, name, count, times in collector.report()]
+        self.assertTrue("Map.render" in names)
+        self.assertTrue("InfoLayer.prepare" in names)
+        render = collector.events[(None, "Map.render")][0]
+        self.assertEqual((render.features, render.vertices), (1, 2))
+        self.assertTrue(render.output_bytes > 0)
+        self.assertEqual(collector.percentiles("Map.render", field='features'),
+                         {50: 1, 90: 1, 99: 1})
+
+    def test_stream_events(self):
+        collector = instrumentation.PercentileCollector()
+        instrumentation.add_collector(collector)
+        try:
+            chunks = Map([InfoLayer([["SRID=4326;LINESTRING(0 0,1 1)", "a"]])
+                         ]).stream("map", None)
+            first = next(chunks)
+            # Events are emitted once the stream has been read.
+            self.assertEqual(collector.events, {})
+            output = first + "".join(chunks)
+        finally:
+            instrumentation.remove_collector(collector)
+        render = collector.events[(None, "Map.render")][0]
+        self.assertEqual((render.features, render.vertices), (1, 2))
+        self.assertEqual(render.output_bytes, len(output))
+        prepare = collector.events[(None, "InfoLayer.prepare")][0]
+        self.assertEqual(prepare.features, 1)
+        self.assertTrue(0 < prepare.output_bytes < len(output))
+
+class TestBootstrap(TestCase):
+    def test_bootstrap(self):
+        info = [[Point(0, 0, srid=4326), "</script>"]]
+        output = InfoMap(info, {'bootstrap': True}).render("map", None,
+                {'id': 'map_id'})
+        self.assertFalse('new olwidget.Map' in output)
+        start = output.index('class="olwidgetMapData">') + \
+                len('class="olwidgetMapData">')
+        data = json.loads(output[start:output.index('</script>', start)])
+        self.assertEqual(data['id'], 'map_id')
+        self.assertEqual(data['layers'][0]['type'], 'InfoLayer')
+        self.assertEqual(data['layers'][0]['info'][0][1], '</script>')
+        self.assertFalse('bootstrap' in data['options'])
+
+        output = EditableMap({'bootstrap': True}).render("geom", None,
+                {'id': 'map_id'})
+        self.assertTrue('<textarea' in output)
+        self.assertTrue('"textareaId": "map_id_geom"' in output)
+
+    @override_settings(OLWIDGET_CUSTOM_LAYER_TYPES={
+        'first': 'OpenLayers.Layer.WMS("first")',
+        'second': 'OpenLayers.Layer.WMS("second")',
+    })
+    def test_custom_layer_types(self):
+        # Only the custom layer types which the map uses are included.
+        for options in ({}, {'bootstrap': True}):
+            output = InfoMap([], dict(options, layers=['first'])).render(
+                    "map", None, {'id': 'map_id'})
+            self.assertTrue('"first"' in output)
+            self.assertFalse('"second"' in output)
+
+            output = InfoMap([], options).render("map", None, {'id': 'map_id'})
+            self.assertFalse('"first"' in output)
+            self.assertFalse('customLayerTypes' in output)
+
+# Import time is measured by the olwidget_benchmark command; here, check
+# that the slow imports are deferred.
+IMPORT_SCRIPT = """
+import json, sys
+import olwidget.widgets
+print(json.dumps({
+    'geos': 'django.contrib.gis.geos' in sys.modules,
+    'numpy': 'numpy' in sys.modules,
+}))
+"""
+
+class TestImport(TestCase):
+    def test_deferred_imports(self):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        self.assertFalse(result['geos'])
+        self.assertFalse(result['numpy'])
+
+    def test_settings_override(self):
+        with override_settings(OLWIDGET_JS="/custom/olwidget.js"):
+            self.assertTrue("/custom/olwidget.js" in unicode(Map([]).media))
+        self.assertFalse("/custom/olwidget.js" in unicode(Map([]).media))
@@ -1,18 +1,100 @@
+import copy
+import hashlib
+import json
+import logging
+import math
 import re
+import threading
+import time
 
 from django.conf import settings
-from django.contrib.gis.geos import GEOSGeometry
+
+logger = logging.getLogger('olwidget')
 
 DEFAULT_PROJ = "4326"
-DEFAULT_OPTIONS = getattr(settings, 'OLWIDGET_DEFAULT_OPTIONS', {})
+
+# Defaults for the settings olwidget uses, which can all be overridden in
+# settings.py.  Those in STATIC_SETTINGS are paths relative to
+# OLWIDGET_STATIC_URL.
+SETTING_DEFAULTS = {
+    'OLWIDGET_DEFAULT_OPTIONS': {},
+    'OLWIDGET_CUSTOM_LAYER_TYPES': {},
+    'GOOGLE_API_KEY': "",
+    'YAHOO_APP_ID': "",
+    'CLOUDMADE_API_KEY': "",
+    'GOOGLE_API': "//maps.google.com/maps/api/js?v=3&sensor=false",
+    'YAHOO_API': "http://api.maps.yahoo.com/ajaxymap?v=3.0",
+    'OSM_API': "//openstreetmap.org/openlayers/OpenStreetMap.js",
+    'OL_API': "http://openlayers.org/api/2.11/OpenLayers.js",
+    'MS_VE_API' : "//ecn.dev.virtualearth.net/mapcontrol/mapcontrol.ashx?v=6.2&s=1",
+}
+STATIC_SETTINGS = {
+    'CLOUDMADE_API': "js/cloudmade.js",
+    'OLWIDGET_JS': "js/olwidget.js",
+    'OLWIDGET_CSS': "css/olwidget.css",
+}
+
+class OlwidgetSettings(object):
+    """
+    The settings olwidget uses, with its defaults for those which aren't in
+    settings.py.  Settings are read on first use rather than when olwidget
+    is imported, and cached until Django's settings are replaced (as by
+    ``override_settings``) or ``clear()`` is called.
+    """
+    def __init__(self):
+        self._values = {}
+        self._wrapped = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._wrapped is not settings._wrapped:
+            self.clear()
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if hasattr(settings, name):
+            value = getattr(settings, name)
+        elif name == 'OLWIDGET_STATIC_URL':
+            value = url_join(settings.STATIC_URL, "olwidget")
+        elif name in STATIC_SETTINGS:
+            value = url_join(self.OLWIDGET_STATIC_URL, STATIC_SETTINGS[name])
+        elif name in SETTING_DEFAULTS:
+            value = SETTING_DEFAULTS[name]
+        else:
+            raise AttributeError(name)
+        self._wrapped = settings._wrapped
+        self._values[name] = value
+        return value
+
+    def clear(self):
+        self._values = {}
+        self._wrapped = None
+
+olwidget_settings = OlwidgetSettings()
 
 def get_options(o):
-    options = DEFAULT_OPTIONS.copy()
+    options = olwidget_settings.OLWIDGET_DEFAULT_OPTIONS.copy()
     options.update(o or {})
     return options
 
+# Options which are only used while rendering on the server, and aren't
+# passed on to olwidget.js.
+SERVER_OPTIONS = ('simplify', 'max_vertices', 'cache_timeout', 'cache_tag',
+                  'cache_key',
+                  'bootstrap', 'change_tolerance', 'server_cluster',
+                  'server_cluster_distance', 'server_cluster_max_zoom',
+                  'max_input_bytes', 'max_input_vertices',
+                  'max_input_components', 'max_input_depth')
+
+def client_options(options):
+    """ Return a copy of ``options`` without any SERVER_OPTIONS. """
+    return dict((k, v) for k, v in options.iteritems()
+                if k not in SERVER_OPTIONS)
+
 def get_custom_layer_types():
-    return getattr(settings, 'OLWIDGET_CUSTOM_LAYER_TYPES', {})
+    return olwidget_settings.OLWIDGET_CUSTOM_LAYER_TYPES
 
 def url_join(*args):
     return reduce(_reduce_url_parts, args)
@@ -35,59 +117,661 @@ def translate_options(options):
             translated[new_key] = value
     return translated
 
+_camelcase_keys = {}
 def _separated_lowercase_to_lower_camelcase(input_):
-    return re.sub('_\w', lambda match: match.group(0)[-1].upper(), input_)
+    # Option keys come from a small vocabulary, so memoize the conversion.
+    try:
+        return _camelcase_keys[input_]
+    except KeyError:
+        output = re.sub('_\w', lambda match: match.group(0)[-1].upper(),
+                        input_)
+        _camelcase_keys[input_] = output
+        return output
+
+class OptionsJSON(object):
+    """
+    Memoizes the translated JSON encoding of an options dict.  The encoding is
+    recomputed only when the options no longer equal a snapshot taken at the
+    last encoding, so in-place changes (including to nested dicts) are
+    noticed.  Widget copies made with ``copy.copy`` share the memo.
+    """
+    def __init__(self):
+        # (snapshot, json) -- replaced as a pair so that concurrent renders
+        # never see a mismatched snapshot and encoding.
+        self.memo = (None, None)
 
+    def encode(self, options):
+        snapshot, encoded = self.memo
+        if encoded is None or options != snapshot:
+            encoded = json.dumps(translate_options(options))
+            self.memo = (copy.deepcopy(options), encoded)
+        return encoded
 
-def get_ewkt(value, srid=None):
+
+class SerializedEWKT(unicode):
+    """
+    EWKT serialized by the database, which ``get_ewkt`` passes through
+    without a round trip through GEOS when it is already in the requested
+    projection.  Other strings are always parsed and normalized.
+    """
+
+def get_ewkt(value, srid=None, precision=None):
     if srid is None:
         if hasattr(value, 'srid'):
             srid = value.srid
         else:
             srid = DEFAULT_PROJ
-    return _add_srid(_get_wkt(value, srid), srid)
+    if isinstance(value, SerializedEWKT) and precision is None:
+        match = _ewkt_re.match(value)
+        if match and int(match.group('srid')) == int(srid):
+            return value
+    return _add_srid(_get_wkt(value, srid, precision), srid)
 
 def get_geos(value, srid=DEFAULT_PROJ):
-    geos = None
-    if value:
-        if isinstance(value, GEOSGeometry):
-            geos = value
-        elif isinstance(value, basestring):
-            match = _ewkt_re.match(value)
-            if match:
-                geos = GEOSGeometry(match.group('wkt'), match.group('srid'))
-            else:
-                geos = GEOSGeometry(value, srid)
-    if geos and geos.srid and int(srid) != geos.srid:
-        geos.transform(int(srid))
+    geos = _get_stored_geos(value, srid)
+    if geos:
+        # Don't modify geometries which belong to the caller.
+        geos = transform(geos, srid, clone=geos is value)
     return geos
 
-def collection_ewkt(fields, srid=DEFAULT_PROJ):
-    return _add_srid(_collection_wkt(fields, srid), srid)
+def _get_stored_geos(value, srid):
+    """
+    Like ``get_geos``, but without reprojecting ``value``; ``srid`` is only
+    used for strings which don't give one.
+    """
+    from django.contrib.gis.geos import GEOSGeometry
+    if not value:
+        return None
+    if isinstance(value, GEOSGeometry):
+        return value
+    if isinstance(value, basestring):
+        match = _ewkt_re.match(value)
+        if match:
+            return GEOSGeometry(match.group('wkt'), match.group('srid'))
+        return GEOSGeometry(value, srid)
+    return None
+
+def geometry_digest(value):
+    """
+    Return a digest of the geometry ``value``, a geometry or (E)WKT string,
+    as it is stored, which ``delta_submit`` changes carry to show which
+    version of the geometry they were made to.
+    """
+    geos = _get_stored_geos(value, DEFAULT_PROJ)
+    return hashlib.sha1(geos.hexewkb if geos else "").hexdigest()
+
+class InputLimitExceeded(ValueError):
+    """
+    Raised by ``check_input_limits`` for geometry input over one of its
+    limits.  ``limit`` is the name of the limit, and ``value`` its value.
+    """
+    def __init__(self, limit, value):
+        super(InputLimitExceeded, self).__init__(
+                "Geometry input exceeds %s=%s" % (limit, value))
+        self.limit = limit
+        self.value = value
+
+# Options limiting the size of submitted geometries.
+INPUT_LIMIT_OPTIONS = ('max_input_bytes', 'max_input_vertices',
+                       'max_input_components', 'max_input_depth')
+
+_paren_re = re.compile(r"[()]")
+# WKT and EWKT (and the changes submitted by delta_submit) start with a
+# letter, unlike HEX(E)WKB and GeoJSON.
+_wkt_start_re = re.compile(r"\s*(SRID=-?\d+;\s*)?[A-Za-z]")
+
+def check_input_limits(value, max_input_bytes=None, max_input_vertices=None,
+        max_input_components=None, max_input_depth=None):
+    """
+    Check the size of the submitted geometry text ``value`` without parsing
+    it, raising ``InputLimitExceeded`` if it is over any of the given limits.
+    In WKT, vertices are separated by commas, and components (points of
+    multipoints, rings, polygons and collection members) are parenthesized,
+    so the check only counts characters, regardless of the geometry.  Other
+    formats, which can't be checked this way, are rejected when any limit but
+    ``max_input_bytes`` is set.
+    """
+    if max_input_bytes is not None and len(value) > max_input_bytes:
+        raise InputLimitExceeded('max_input_bytes', max_input_bytes)
+    if (max_input_vertices is None and max_input_components is None and
+            max_input_depth is None):
+        return
+    if not _wkt_start_re.match(value):
+        raise InputLimitExceeded('input_format', 'WKT')
+    if (max_input_vertices is not None and
+            value.count(",") + 1 > max_input_vertices):
+        raise InputLimitExceeded('max_input_vertices', max_input_vertices)
+    if max_input_components is None and max_input_depth is None:
+        return
+    components = value.count("(")
+    if max_input_components is not None and components > max_input_components:
+        raise InputLimitExceeded('max_input_components', max_input_components)
+    if max_input_depth is not None and components > max_input_depth:
+        depth = 0
+        for paren in _paren_re.findall(value):
+            if paren == "(":
+                depth += 1
+                if depth > max_input_depth:
+                    raise InputLimitExceeded('max_input_depth',
+                                             max_input_depth)
+            else:
+                depth -= 1
+
+# GDAL transforms aren't thread safe, so keep one per thread and SRID pair.
+_coord_transforms = threading.local()
+
+def get_transform(source, target):
+    """
+    Return a ``CoordTransform`` from the SRID ``source`` to ``target``.
+    Transforms are cached, since building the spatial references and the
+    transform costs much more than transforming a typical geometry.
+    """
+    key = (int(source), int(target))
+    transforms = _coord_transforms.__dict__
+    if key not in transforms:
+        from django.contrib.gis.gdal import CoordTransform, SpatialReference
+        transforms[key] = CoordTransform(SpatialReference(key[0]),
+                                         SpatialReference(key[1]))
+    return transforms[key]
+
+def transform(geos, srid, clone=True):
+    """
+    Return ``geos`` in the projection for the given SRID, using a cached
+    transform.  Unless ``clone`` is False, a transformed copy is returned and
+    ``geos`` is left unchanged.  Geometries without an SRID, or already in
+    the projection, are returned as they are.
+    """
+    srid = int(srid)
+    if not geos.srid or geos.srid == srid:
+        return geos
+    result = geos.transform(get_transform(geos.srid, srid), clone=clone)
+    if not clone:
+        result = geos
+    # The SRID read back from GDAL may be missing for non-EPSG projections.
+    result.srid = srid
+    return result
+
+def transform_geometries(geometries, srid):
+    """
+    Return transformed copies of each of ``geometries``, reusing one cached
+    transform for each source SRID.
+    """
+    return [transform(geos, srid) for geos in geometries]
+
+def geometry_changed(initial, data, srid=DEFAULT_PROJ, tolerance=0):
+    """
+    Return True if the geometry ``data`` differs from ``initial``; either may
+    be a geometry or an (E)WKT string.  Cheap comparisons are tried first:
+    the normalized EWKT strings, then geometry types, vertex counts and
+    extents.  The geometries are only compared with GEOS ``equals_exact``,
+    with the given ``tolerance``, if these are inconclusive.  The comparison
+    used and its time are logged to the ``olwidget`` logger at DEBUG level.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return _geometry_changed(initial, data, srid, tolerance)[0]
+    start = time.time()
+    changed, comparison = _geometry_changed(initial, data, srid, tolerance)
+    logger.debug("geometry %s by %s comparison in %.6fs",
+            "changed" if changed else "unchanged", comparison,
+            time.time() - start)
+    return changed
+
+_wkt_space_re = re.compile(r"\s*([(),;=])\s*|\s+")
+def _normalize_wkt(wkt):
+    return _wkt_space_re.sub(lambda m: m.group(1) or " ", wkt.strip()).upper()
+
+def _geometry_changed(initial, data, srid, tolerance):
+    """ Return (changed, name of the deciding comparison). """
+    if is_delta(data):
+        try:
+            delta = parse_delta(data)
+        except ValueError:
+            return (True, "delta")
+        return (bool(delta['modified'] or delta['added'] or delta['deleted']),
+                "delta")
+    if not initial or not data:
+        return (bool(initial) != bool(data), "empty")
+
+    # An unedited textarea submits the EWKT it was rendered with.
+    if isinstance(data, basestring):
+        if _normalize_wkt(get_ewkt(initial)) == _normalize_wkt(data):
+            return (False, "string")
+
+    initial = get_geos(initial, srid)
+    data = get_geos(data, srid)
+    if initial.geom_type != data.geom_type:
+        return (True, "type")
+    if initial.num_coords != data.num_coords:
+        return (True, "vertex count")
+    for a, b in zip(initial.extent, data.extent):
+        if abs(a - b) > tolerance:
+            return (True, "extent")
+    return (not initial.equals_exact(data, tolerance), "equals_exact")
+
+# Prefix of the values submitted by editable layers with the ``delta_submit``
+# option, which hold changes to the components of a geometry collection.
+DELTA_PREFIX = "DELTA;"
+
+_collection_classes = {
+    'MULTIPOINT': 'MultiPoint',
+    'MULTILINESTRING': 'MultiLineString',
+    'MULTIPOLYGON': 'MultiPolygon',
+    'GEOMETRYCOLLECTION': 'GeometryCollection',
+}
+
+class GeometryDelta(object):
+    """
+    Changes submitted by a ``delta_submit`` layer, along with the ``base``
+    geometry they apply to, for redisplaying the layer.
+    """
+    def __init__(self, base, delta):
+        self.base = base
+        self.delta = delta
+
+def is_delta(value):
+    return isinstance(value, basestring) and value.startswith(DELTA_PREFIX)
+
+def parse_delta(value):
+    """
+    Parse the changes submitted by a layer with the ``delta_submit`` option:
+    ``DELTA;`` followed by a JSON object with the ``srid`` of the submitted
+    WKT, the geometry ``type``, the ``geometry_digest`` (``base``) and number
+    of components (``size``) of the geometry they apply to, ``modified``, a
+    mapping of component indexes to WKT, ``added``, a list of WKT, and
+    ``deleted``, a list of indexes.  Raises ValueError if the value is
+    malformed.
+    """
+    try:
+        data = json.loads(value[len(DELTA_PREFIX):])
+        delta = {
+            'srid': int(data['srid']),
+            'type': unicode(data.get('type', '')).upper(),
+            'base': unicode(data['base']),
+            'size': int(data['size']),
+            'modified': dict((int(k), v) for k, v in
+                             data.get('modified', {}).iteritems()),
+            'added': list(data.get('added', [])),
+            'deleted': set(int(i) for i in data.get('deleted', [])),
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Malformed geometry changes.")
+    indexes = set(delta['modified']) | delta['deleted']
+    if indexes and (min(indexes) < 0 or max(indexes) >= delta['size']):
+        raise ValueError("Malformed geometry changes.")
+    return delta
+
+def apply_delta(base, value):
+    """
+    Return the geometry collection ``base`` with the changes submitted by a
+    ``delta_submit`` layer applied, or None if no components are left.  Only
+    the changed components are parsed, and transformed to the projection of
+    ``base``; the others are kept as they are.  Raises ValueError if the
+    changes are malformed or were made to a different geometry.
+    """
+    from django.contrib.gis import geos
+    delta = parse_delta(value)
+    srid = delta['srid']
+    base = _get_stored_geos(base, srid)
+    if base and base.geom_type.upper() not in _collection_classes:
+        raise ValueError("Only collections can be changed by component.")
+    components = list(base) if base else []
+    if (len(components) != delta['size'] or
+            geometry_digest(base) != delta['base']):
+        raise ValueError("The geometry was changed by someone else while "
+                         "it was being edited.")
+    if not (delta['modified'] or delta['added'] or delta['deleted']):
+        return base or None
+
+    geom_type = base.geom_type.upper() if base else delta['type']
+    if geom_type not in _collection_classes:
+        raise ValueError("Malformed geometry changes.")
+    target = base.srid if base and base.srid else srid
+    try:
+        result = []
+        for i, component in enumerate(components):
+            if i in delta['deleted']:
+                continue
+            if i in delta['modified']:
+                component = transform(geos.GEOSGeometry(
+                        delta['modified'][i], srid), target, clone=False)
+            result.append(component)
+        for wkt in delta['added']:
+            result.append(transform(geos.GEOSGeometry(wkt, srid), target,
+                                    clone=False))
+        if not result:
+            return None
+        collection_class = getattr(geos, _collection_classes[geom_type])
+        return collection_class(result, srid=target)
+    except (geos.GEOSException, ValueError, TypeError):
+        raise ValueError("Invalid geometry in the submitted changes.")
+
+# Spherical mercator projections, which are converted to and from WGS84
+# without GDAL.
+MERCATOR_SRIDS = (900913, 3857, 3785, 102113)
+MERCATOR_RADIUS = 6378137.0
+MERCATOR_MAX_LATITUDE = 85.0511287798
+
+_numpy = []
+
+def get_numpy():
+    """
+    Return the NumPy module, or None if it isn't installed.  It is imported
+    on first use rather than with olwidget, since importing it is slow.
+    """
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+def transform_coordinates(x, y, source, target):
+    """
+    Return the coordinate sequences ``x`` and ``y`` reprojected from SRID
+    ``source`` to ``target``, as NumPy arrays if NumPy is installed, and as
+    lists otherwise.  Conversions between WGS84 and spherical mercator are
+    computed directly; other projections use one cached GDAL transform for
+    all of the points.
+    """
+    source, target = int(source), int(target)
+    numpy = get_numpy()
+    if numpy is not None:
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+    else:
+        x = [float(v) for v in x]
+        y = [float(v) for v in y]
+    if source == target or not len(x):
+        return (x, y)
+    if source == 4326 and target in MERCATOR_SRIDS:
+        return _to_mercator(x, y)
+    if source in MERCATOR_SRIDS and target == 4326:
+        return _from_mercator(x, y)
+
+    coords = list(zip(x, y))
+    if len(coords) == 1:
+        # A linestring needs two points.
+        coords = coords * 2
+    from django.contrib.gis.geos import LineString
+    line = LineString(coords, srid=source)
+    coords = transform(line, target, clone=False).coords[:len(x)]
+    x = [c[0] for c in coords]
+    y = [c[1] for c in coords]
+    if numpy is not None:
+        return (numpy.array(x), numpy.array(y))
+    return (x, y)
+
+def _to_mercator(lon, lat):
+    scale = MERCATOR_RADIUS * math.pi / 180
+    numpy = get_numpy()
+    if numpy is not None:
+        lat = numpy.radians(numpy.clip(lat, -MERCATOR_MAX_LATITUDE,
+                                       MERCATOR_MAX_LATITUDE))
+        return (lon * scale, MERCATOR_RADIUS *
+                numpy.log(numpy.tan(math.pi / 4 + lat / 2)))
+    return ([v * scale for v in lon],
+            [MERCATOR_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(
+                max(-MERCATOR_MAX_LATITUDE, min(MERCATOR_MAX_LATITUDE, v))) / 2))
+             for v in lat])
+
+def _from_mercator(x, y):
+    scale = 180 / (MERCATOR_RADIUS * math.pi)
+    numpy = get_numpy()
+    if numpy is not None:
+        return (x * scale, numpy.degrees(
+            2 * numpy.arctan(numpy.exp(y / MERCATOR_RADIUS)) - math.pi / 2))
+    return ([v * scale for v in x],
+            [math.degrees(2 * math.atan(math.exp(v / MERCATOR_RADIUS)) -
+                          math.pi / 2) for v in y])
+
+# Resolution of spherical mercator zoom level 0, in meters per pixel.
+MERCATOR_MAX_RESOLUTION = 156543.03392804062
+MERCATOR_MAX_EXTENT = 20037508.342789244
+
+def grid_clusters(x, y, max_zoom=18, distance=20):
+    """
+    Cluster points, given by spherical mercator coordinate sequences ``x``
+    and ``y``, on a grid of cells ``distance`` pixels wide at each zoom level
+    from 0 to ``max_zoom``, stopping early at the first level where each
+    point has its own cell.  Each level's cells are quarters of the cells of
+    the level above, so the points can be ordered such that the members of
+    every cluster, at every level, are contiguous.
+
+    Returns ``(order, levels)``, where ``order`` is the list of point indexes
+    in that order, and ``levels`` is a list for each zoom level of
+    ``(x, y, count)`` clusters, with the mean coordinates of their members,
+    also in that order.
+    """
+    cell = distance * MERCATOR_MAX_RESOLUTION / 2 ** max_zoom
+    cells = [(int((x[i] + MERCATOR_MAX_EXTENT) // cell),
+              int((y[i] + MERCATOR_MAX_EXTENT) // cell))
+             for i in range(len(x))]
+    # Morton (Z-order) sorting keeps the points in each cell of each level
+    # together.
+    order = sorted(range(len(cells)), key=lambda i: _spread_bits(
+        cells[i][0]) | (_spread_bits(cells[i][1]) << 1))
+
+    levels = []
+    for zoom in range(max_zoom + 1):
+        shift = max_zoom - zoom
+        level = []
+        key = None
+        for i in order:
+            cell_key = (cells[i][0] >> shift, cells[i][1] >> shift)
+            if cell_key != key:
+                key = cell_key
+                level.append([0.0, 0.0, 0])
+            cluster = level[-1]
+            cluster[0] += x[i]
+            cluster[1] += y[i]
+            cluster[2] += 1
+        levels.append([(cx / n, cy / n, n) for cx, cy, n in level])
+        if len(level) == len(order):
+            break
+    return (order, levels)
+
+def tile_bounds(z, x, y):
+    """
+    Return the ``(xmin, ymin, xmax, ymax)`` spherical mercator bounds of tile
+    ``x``, ``y`` at zoom level ``z`` in the OpenStreetMap / Google tile grid,
+    which counts rows from the top.
+    """
+    size = 2 * MERCATOR_MAX_EXTENT / 2 ** z
+    xmin = -MERCATOR_MAX_EXTENT + x * size
+    ymax = MERCATOR_MAX_EXTENT - y * size
+    return (xmin, ymax - size, xmin + size, ymax)
+
+def _spread_bits(value):
+    """ Spread the bits of a 32 bit integer into the even bits of 64. """
+    value &= 0xffffffff
+    value = (value | (value << 16)) & 0x0000ffff0000ffff
+    value = (value | (value << 8)) & 0x00ff00ff00ff00ff
+    value = (value | (value << 4)) & 0x0f0f0f0f0f0f0f0f
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+def encode_column(values, precision=None):
+    """
+    Return a list of the numbers in ``values``, rounded to ``precision``
+    decimal places if given, ready for JSON encoding.
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=float)
+        if precision is not None:
+            values = numpy.round(values, precision)
+        return values.tolist()
+    if precision is not None:
+        return [round(v, precision) for v in values]
+    return list(values)
+
+def get_geojson(value, srid=DEFAULT_PROJ, precision=None):
+    """
+    Return a GeoJSON geometry dict for ``value`` in the projection for the
+    given SRID, with coordinates rounded to ``precision`` decimal places.
+    """
+    geos = get_geos(value, srid)
+    if not geos:
+        return None
+    def encode(coords):
+        if precision is None:
+            return [list(c[:2]) for c in coords]
+        return [[round(c[0], precision), round(c[1], precision)]
+                for c in coords]
+    return _geojson_geometry(geos, encode, True)
+
+def get_polyline(value, srid=DEFAULT_PROJ, precision=None):
+    """
+    Like ``get_geojson``, but each coordinate sequence is replaced by an
+    encoded polyline string (see ``encode_polyline``).
+    """
+    geos = get_geos(value, srid)
+    if not geos:
+        return None
+    if precision is None:
+        precision = POLYLINE_PRECISION
+    return _geojson_geometry(geos,
+            lambda coords: encode_polyline(coords, precision), False)
+
+def encode_geometry(value, encoding=None, precision=None):
+    """
+    Serialize ``value`` for olwidget.js using the named encoding, one of
+    ``'wkt'`` (the default), ``'geojson'`` or ``'polyline'``.
+    """
+    if encoding is None or encoding == 'wkt':
+        return get_ewkt(value, precision=precision)
+    elif encoding == 'geojson':
+        return get_geojson(value, precision=precision)
+    elif encoding == 'polyline':
+        return get_polyline(value, precision=precision)
+    raise ValueError("Unknown geometry encoding: %s" % encoding)
+
+def _geojson_geometry(geos, encode, unwrap_points):
+    if geos.geom_type == 'GeometryCollection':
+        return {
+            'type': 'GeometryCollection',
+            'geometries': [_geojson_geometry(g, encode, unwrap_points)
+                           for g in geos],
+        }
+    return {
+        'type': geos.geom_type,
+        'coordinates': _geojson_coordinates(geos, encode, unwrap_points),
+    }
+
+def _geojson_coordinates(geos, encode, unwrap_points):
+    if geos.geom_type == 'Point':
+        coords = encode([geos.coords])
+        if unwrap_points:
+            return coords[0]
+        return coords
+    elif geos.geom_type in ('LineString', 'LinearRing', 'MultiPoint'):
+        # A MultiPoint's points are one sequence, as in GeoJSON.
+        return encode(geos.coords)
+    # Polygons (rings) and other multi-geometries (members).
+    return [_geojson_coordinates(g, encode, unwrap_points) for g in geos]
+
+# Default number of decimal places kept by encode_polyline.
+POLYLINE_PRECISION = 5
+
+def encode_polyline(coords, precision=POLYLINE_PRECISION):
+    """
+    Encode a sequence of (x, y) coordinates using the encoded polyline
+    algorithm: each value is stored as a zigzag varint of its difference
+    from the previous value, in printable ASCII.
+    """
+    factor = 10 ** precision
+    output = []
+    prev_x = prev_y = 0
+    for coord in coords:
+        x = int(round(coord[0] * factor))
+        y = int(round(coord[1] * factor))
+        _encode_polyline_value(x - prev_x, output)
+        _encode_polyline_value(y - prev_y, output)
+        prev_x, prev_y = x, y
+    return "".join(output)
+
+def _encode_polyline_value(value, output):
+    if value < 0:
+        value = ~(value << 1)
+    else:
+        value = value << 1
+    while value >= 0x20:
+        output.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    output.append(chr(value + 63))
+
+def collection_ewkt(fields, srid=DEFAULT_PROJ, precision=None):
+    return _add_srid(_collection_wkt(fields, srid, precision), srid)
 
 _ewkt_re = re.compile("^SRID=(?P<srid>\d+);(?P<wkt>.+)$", re.I)
-def _get_wkt(value, srid):
+def _get_wkt(value, srid, precision=None):
     """
     `value` is either a WKT string or a geometry field.  Returns WKT in the
-    projection for the given SRID.
+    projection for the given SRID, with coordinates rounded to `precision`
+    decimal places if given.
     """
     geos = get_geos(value, srid)
     wkt = ''
     if geos:
-        wkt = geos.wkt 
+        if precision is None:
+            wkt = geos.wkt
+        else:
+            wkt = write_wkt(geos, precision)
     return wkt
 
-def _collection_wkt(fields, srid):
+def _collection_wkt(fields, srid, precision=None):
     """ Returns WKT for the given list of geometry fields. """
 
     if not fields:
         return ""
 
     if len(fields) == 1:
-        return _get_wkt(fields[0], srid)
+        return _get_wkt(fields[0], srid, precision)
+
+    wkts = [_get_wkt(field, srid, precision) for field in fields]
+    wkts = [wkt for wkt in wkts if wkt]
+    if not wkts:
+        return ""
+    return "GEOMETRYCOLLECTION(%s)" % ",".join(wkts)
+
+def write_wkt(geos, precision):
+    """
+    Return WKT for ``geos`` with coordinates rounded to ``precision`` decimal
+    places.  Coordinates are formatted directly rather than by a GEOS WKT
+    writer, which before GEOS 3.9 rounds to significant digits when trimming
+    trailing zeros.
+    """
+    fmt = "%%.%df" % precision
+    def format_coord(coord):
+        return " ".join(_trim_number(fmt % c) for c in coord[:2])
+    return _format_wkt(geos, format_coord)
+
+def _trim_number(number):
+    if "." in number:
+        number = number.rstrip("0").rstrip(".")
+    if number == "-0":
+        number = "0"
+    return number
+
+def _format_wkt(geos, format_coord):
+    kind = geos.geom_type.upper()
+    if geos.empty:
+        return "%s EMPTY" % kind
+    if kind == 'GEOMETRYCOLLECTION':
+        return "%s (%s)" % (kind,
+                ", ".join(_format_wkt(g, format_coord) for g in geos))
+    return "%s %s" % (kind, _format_wkt_coords(geos, format_coord))
 
-    return "GEOMETRYCOLLECTION(%s)" % \
-            ",".join(_get_wkt(field, srid) for field in fields)
+def _format_wkt_coords(geos, format_coord):
+    if geos.geom_type == 'Point':
+        return "(%s)" % format_coord(geos.coords)
+    elif geos.geom_type in ('LineString', 'LinearRing'):
+        return "(%s)" % ", ".join(format_coord(c) for c in geos.coords)
+    # Polygons (rings) and multi-geometries (members).
+    return "(%s)" % ", ".join(_format_wkt_coords(g, format_coord)
+                              for g in geos)
 
 def _add_srid(wkt, srid):
     """
@@ -98,6 +782,43 @@ def _add_srid(wkt, srid):
         return "SRID=%s;%s" % (srid, wkt)
     return ""
 
+# Upper bound on how many times ``simplify`` doubles its tolerance while
+# trying to meet ``max_vertices``.
+MAX_SIMPLIFY_STEPS = 16
+
+def simplify_tolerance(zoom=None, extent=None):
+    """
+    Return a simplification tolerance of about one pixel, in degrees, either
+    at the given zoom level or for a map fit to ``extent`` (an ``(xmin, ymin,
+    xmax, ymax)`` tuple in degrees).
+    """
+    if zoom is not None:
+        return 360.0 / (256 * 2 ** int(zoom))
+    if extent:
+        return max(extent[2] - extent[0], extent[3] - extent[1]) / 1024.0
+    return 0
+
+def simplify(geos, tolerance=None, max_vertices=None):
+    """
+    Return a topology-preserving simplification of ``geos``.  If
+    ``max_vertices`` is given, the tolerance is doubled until the result has
+    at most that many vertices.
+    """
+    if not geos:
+        return geos
+    simplified = geos
+    if tolerance:
+        simplified = geos.simplify(tolerance, preserve_topology=True)
+    if max_vertices and simplified.num_coords > max_vertices:
+        if not tolerance:
+            tolerance = simplify_tolerance(extent=geos.extent)
+        for i in range(MAX_SIMPLIFY_STEPS):
+            if simplified.num_coords <= max_vertices or tolerance <= 0:
+                break
+            tolerance *= 2
+            simplified = geos.simplify(tolerance, preserve_topology=True)
+    return simplified
+
 def options_for_field(db_field):
     is_collection = db_field.geom_type in ('MULTIPOINT', 'MULTILINESTRING', 
             'MULTIPOLYGON', 'GEOMETRYCOLLECTION', 'GEOMETRY')
@@ -0,0 +1,295 @@
+"""
+Views serving map data to olwidget.js.
+
+``info_layer_data`` serves the info for a ``BBoxInfoLayer`` from a queryset,
+only including objects within the map's current viewport::
+
+    from olwidget.views import info_layer_data
+
+    def tree_data(request):
+        return info_layer_data(request, Tree.objects.all(), 'location',
+                html=lambda tree: tree.species)
+
+``info_layer_tile`` serves a ``TileInfoLayer`` the same way, one map tile at
+a time, or serves Mapbox Vector Tiles to other clients::
+
+    url(r'^trees/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<format>json|mvt)$',
+        'myapp.views.tree_tile')
+
+    def tree_tile(request, z, x, y, format):
+        return info_layer_tile(request, Tree.objects.all(), 'location',
+                z, x, y, format=format, attributes=['species'])
+
+With ``stream=True``, these views encode the info as it is sent, in a
+streaming response, so that the whole JSON is never held in memory.
+"""
+import json
+
+from django.contrib.gis.geos import Polygon
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.utils.encoding import force_unicode
+
+from olwidget import cache, utils
+from olwidget.widgets import InfoLayer
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Before Django 1.5, HttpResponse streams iterators itself.
+    StreamingHttpResponse = HttpResponse
+
+# Default maximum number of objects returned for a viewport.
+DEFAULT_LIMIT = 1000
+
+# Deepest tile zoom level served by info_layer_tile.
+MAX_TILE_ZOOM = 24
+
+# Margin, in pixels, around each vector tile within which geometries are
+# kept when they are clipped to the tile.
+TILE_BUFFER = 8
+
+def info_layer_data(request, queryset, fields, html=None, limit=DEFAULT_LIMIT,
+        options=None, stream=False):
+    """
+    Return the info for objects in ``queryset`` which have a geometry, in any
+    of the geometry fields named in ``fields``, which intersects the
+    request's ``bbox`` parameter, in the projection given by its ``srid``
+    parameter (by default, EPSG:4326).  ``html`` is a function returning the
+    popup html for an object (by default, its unicode representation).  At
+    most ``limit`` objects are returned.  ``options`` should be those of the
+    layer, so that geometries are encoded as it expects.  If ``stream`` is
+    True, the response is streamed.
+    """
+    if isinstance(fields, basestring):
+        fields = [fields]
+    bbox = parse_bbox(request.GET.get('bbox'), request.GET.get('srid'))
+    if bbox is None:
+        return HttpResponseBadRequest("Expected a bbox parameter.")
+    objects = list(filter_bbox(queryset, fields, bbox)[:limit + 1])
+    return info_response(_iter_info(objects[:limit], fields, html), options,
+            truncated=len(objects) > limit, zoom=request.GET.get('zoom'),
+            stream=stream)
+
+def info_layer_tile(request, queryset, fields, z, x, y, html=None,
+        attributes=None, format="json", limit=DEFAULT_LIMIT, options=None,
+        stream=False):
+    """
+    Return the objects in ``queryset`` with a geometry, in any of the
+    geometry fields named in ``fields``, which intersects tile
+    ``z``/``x``/``y`` of the spherical mercator tile grid.  Geometries are
+    simplified to about a pixel at the tile's zoom level, and at most
+    ``limit`` objects are returned.
+
+    If ``format`` is ``"json"``, the tile holds info for a ``TileInfoLayer``,
+    with popup html given by ``html`` as for ``info_layer_data``.  If it is
+    ``"mvt"``, the tile is a Mapbox Vector Tile, with the geometries clipped
+    to the tile and the model fields named in ``attributes`` as each
+    feature's properties; this requires the ``mapbox-vector-tile`` package.
+
+    Tiles are cached if ``options`` has a ``cache_timeout``, and are
+    invalidated along with maps having the same ``cache_tag``.  The cache key
+    covers the queryset's SQL, the request's path and query string, and
+    ``html`` by its module and name; a lambda or closure for ``html`` needs a
+    ``cache_key`` option which distinguishes its output.  Otherwise, JSON
+    tiles are streamed if ``stream`` is True.
+    """
+    if isinstance(fields, basestring):
+        fields = [fields]
+    try:
+        z, x, y = int(z), int(x), int(y)
+    except ValueError:
+        raise Http404
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise Http404
+    if format not in ("json", "mvt"):
+        raise Http404
+    if format == "mvt" and mapbox_vector_tile is None:
+        raise ImproperlyConfigured("Vector tiles require the "
+                "mapbox-vector-tile package.")
+    options = dict(options or {})
+
+    timeout = options.get('cache_timeout')
+    if timeout:
+        key = cache.make_key(options.get('cache_tag'), ["tile", request.path,
+                sorted(request.GET.lists()), _query_key(queryset),
+                _callable_key(html), fields, attributes, z, x, y, format,
+                limit, options])
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+    bounds = utils.tile_bounds(z, x, y)
+    xs, ys = utils.transform_coordinates([bounds[0], bounds[2]],
+            [bounds[1], bounds[3]], 900913, utils.DEFAULT_PROJ)
+    bbox = Polygon.from_bbox((xs[0], ys[0], xs[1], ys[1]))
+    bbox.srid = int(utils.DEFAULT_PROJ)
+    objects = list(filter_bbox(queryset, fields, bbox)[:limit + 1])
+    truncated = len(objects) > limit
+    objects = objects[:limit]
+
+    if format == "mvt":
+        response = HttpResponse(_vector_tile(objects, fields, attributes,
+                bounds, z, options.get('name') or
+                queryset.model._meta.module_name),
+                content_type="application/vnd.mapbox-vector-tile")
+    else:
+        ids = [obj.pk for obj in objects
+               if any(getattr(obj, field) for field in fields)]
+        options.setdefault('simplify', True)
+        response = info_response(_iter_info(objects, fields, html), options,
+                truncated=truncated, zoom=z, ids=ids,
+                stream=stream and not timeout)
+
+    if timeout:
+        cache.set(key, response, timeout)
+    return response
+
+def _query_key(queryset):
+    """
+    Return the SQL of ``queryset``, for a cache key.
+    """
+    # Before Django 1.6, none() keeps the original query.
+    if isinstance(queryset, EmptyQuerySet):
+        return None
+    try:
+        return str(queryset.query)
+    except EmptyResultSet:
+        # The query matches nothing, without being run.
+        return None
+
+def _callable_key(func):
+    """
+    Return the dotted name of ``func``, or None, for a cache key.
+    """
+    if func is None:
+        return None
+    return "%s.%s" % (getattr(func, '__module__', None),
+            getattr(func, '__name__', type(func).__name__))
+
+def _iter_info(objects, fields, html):
+    """
+    Yield the info for each of ``objects`` with a geometry in ``fields``.
+    """
+    for obj in objects:
+        geoms = [getattr(obj, field) for field in fields]
+        geoms = [geom for geom in geoms if geom]
+        if geoms:
+            yield (utils.collection_ewkt(geoms),
+                   html(obj) if html else force_unicode(obj))
+
+def _vector_tile(objects, fields, attributes, bounds, z, layer_name):
+    """
+    Encode ``objects`` as a Mapbox Vector Tile with the spherical mercator
+    ``bounds``, with a feature for each of their geometries.
+    """
+    tolerance = utils.MERCATOR_MAX_RESOLUTION / 2 ** z
+    clip = Polygon.from_bbox(bounds).buffer(tolerance * TILE_BUFFER)
+    features = []
+    for obj in objects:
+        properties = {}
+        for name in attributes or []:
+            value = getattr(obj, name)
+            if value is None:
+                continue
+            if not isinstance(value, (bool, int, long, float)):
+                value = force_unicode(value)
+            properties[name] = value
+        for field in fields:
+            geom = getattr(obj, field)
+            if not geom:
+                continue
+            geom = utils.simplify(utils.transform(geom, 900913), tolerance)
+            if not clip.contains(geom):
+                geom = geom.intersection(clip)
+                if geom.empty:
+                    continue
+            features.append({
+                'geometry': geom.wkt,
+                'properties': properties,
+                'id': obj.pk,
+            })
+    return mapbox_vector_tile.encode([{
+        'name': layer_name,
+        'features': features,
+    }], quantize_bounds=bounds)
+
+def parse_bbox(value, srid=None):
+    """
+    Return an EPSG:4326 polygon for a bounding box given as
+    ``xmin,ymin,xmax,ymax`` in the projection ``srid`` (by default,
+    EPSG:4326), or None if ``value`` or ``srid`` aren't valid.
+    """
+    try:
+        bbox = [float(v) for v in (value or "").split(",")]
+        srid = int(srid or utils.DEFAULT_PROJ)
+    except ValueError:
+        return None
+    if len(bbox) != 4:
+        return None
+    if srid != int(utils.DEFAULT_PROJ):
+        xs, ys = utils.transform_coordinates([bbox[0], bbox[2]],
+                [bbox[1], bbox[3]], srid, utils.DEFAULT_PROJ)
+        bbox = [xs[0], ys[0], xs[1], ys[1]]
+    polygon = Polygon.from_bbox(bbox)
+    polygon.srid = int(utils.DEFAULT_PROJ)
+    return polygon
+
+def filter_bbox(queryset, fields, bbox):
+    """
+    Filter ``queryset`` to objects with a geometry, in any of ``fields``,
+    which intersects ``bbox``, including geometries entirely within it.  On
+    PostGIS, this comparison uses the geometry columns' spatial indexes;
+    other backends, such as SpatiaLite, may compare every row.
+    """
+    query = Q()
+    for field in fields:
+        query |= Q(**{"%s__intersects" % field: bbox})
+    return queryset.filter(query)
+
+def info_response(info, options=None, truncated=False, zoom=None, ids=None,
+        stream=False):
+    """
+    Return a JSON response with ``info``, encoded according to ``options``,
+    for a ``BBoxInfoLayer`` or ``TileInfoLayer``.  ``truncated`` tells the
+    browser whether objects were left out.  If ``zoom`` is given, it is used
+    to choose the tolerance for the ``simplify`` option.  ``ids`` identify
+    each entry of ``info``, so that objects spanning several tiles are only
+    shown once.  If ``stream`` is True, ``info`` is read and encoded as the
+    response is sent.
+    """
+    options = dict(options or {})
+    options.pop('server_cluster', None)
+    if zoom is not None and options.get('simplify') is True:
+        try:
+            options['default_zoom'] = int(zoom)
+        except ValueError:
+            pass
+    extra = {'truncated': truncated}
+    if ids is not None:
+        extra['ids'] = ids
+    content = json_object_chunks('info',
+            InfoLayer(info, options).iter_info_json(), extra)
+    if stream:
+        return StreamingHttpResponse(content, content_type="application/json")
+    return HttpResponse("".join(content), content_type="application/json")
+
+def json_object_chunks(key, chunks, extra):
+    """
+    Yield a JSON object in chunks, with the JSON encoded ``chunks`` as the
+    value of ``key``, followed by the items of the dict ``extra``.
+    """
+    yield '{%s: ' % json.dumps(key)
+    for chunk in chunks:
+        yield chunk
+    for name, value in extra.iteritems():
+        yield ', %s: %s' % (json.dumps(name), json.dumps(value))
+    yield '}'
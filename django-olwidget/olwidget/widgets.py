@@ -1,39 +1,46 @@
 import json
 import copy
+import itertools
+import re
+import uuid
 
 from django.template.loader import render_to_string
 from django.conf import settings
 from django import forms
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
-from olwidget import utils
+from olwidget import cache, instrumentation, utils
 
-# Default settings for paths and API URLs.  These can all be overridden by
-# specifying a value in settings.py
+# Features encoded in each chunk of a streamed info layer.
+STREAM_CHUNK_SIZE = 500
 
-setattr(settings, "OLWIDGET_STATIC_URL",
-    getattr(settings,
-        "OLWIDGET_STATIC_URL",
-        utils.url_join(settings.STATIC_URL, "olwidget")))
+# Stand in for streamed layer javascript in the rendered map template, with
+# a random token for each render, so that they can't be confused with
+# the map's content.
+STREAM_PLACEHOLDER = "olwidget_stream_%s_%i"
+STREAM_PLACEHOLDER_RE = r"olwidget_stream_%s_(\d+)"
 
-api_defaults = {
-    'GOOGLE_API_KEY': "",
-    'YAHOO_APP_ID': "",
-    'CLOUDMADE_API_KEY': "",
-    'GOOGLE_API': "//maps.google.com/maps/api/js?v=3&sensor=false",
-    'YAHOO_API': "http://api.maps.yahoo.com/ajaxymap?v=3.0",
-    'OSM_API': "//openstreetmap.org/openlayers/OpenStreetMap.js",
-    'OL_API': "http://openlayers.org/api/2.11/OpenLayers.js",
-    'MS_VE_API' : "//ecn.dev.virtualearth.net/mapcontrol/mapcontrol.ashx?v=6.2&s=1",
-    'CLOUDMADE_API': utils.url_join(settings.OLWIDGET_STATIC_URL, "js/cloudmade.js"),
-    'OLWIDGET_JS': utils.url_join(settings.OLWIDGET_STATIC_URL, "js/olwidget.js"),
-    'OLWIDGET_CSS': utils.url_join(settings.OLWIDGET_STATIC_URL, "css/olwidget.css"),
-}
-
-for key, default in api_defaults.iteritems():
-    if not hasattr(settings, key):
-        setattr(settings, key, default)
+# Stands in for the info array in a streamed InfoLayer's template, likewise.
+INFO_PLACEHOLDER = "olwidget_stream_info_%s"
 
+def _timed_chunks(stream):
+    """
+    Yield the chunks of a layer ``stream`` from ``Map._render``, adding the
+    time spent producing them to its ``seconds``.
+    """
+    chunks = iter(stream['chunks'])
+    while True:
+        start = instrumentation.timer()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            stream['seconds'] += instrumentation.timer() - start
+        yield chunk
 
 #
 # Map widget
@@ -51,54 +58,233 @@ class Map(forms.Widget):
     def __init__(self, vector_layers=None, options=None, template=None,
             layer_names=None):
         self.vector_layers = VectorLayerList()
-        for layer in vector_layers:
-            self.vector_layers.append(layer)
         self.layer_names = layer_names
         self.options = utils.get_options(options)
+        for layer in vector_layers:
+            # Layers inherit options from the map, as in olwidget.js.
+            layer.map_options = self.options
+            self.vector_layers.append(layer)
         # Though this layer is the olwidget.js default, it must be explicitly
         # set so {{ form.media }} knows to include osm.
         self.options['layers'] = self.options.get('layers', ['osm.mapnik'])
         self.custom_layer_types = utils.get_custom_layer_types()
         self.template = template or self.default_template
+        self._options_json = utils.OptionsJSON()
         super(Map, self).__init__()
 
+    @instrumentation.instrumented("Map.render",
+            lambda output, self, name, value, attrs=None: dict(
+                zip(('features', 'vertices'), self.get_size(value)),
+                output_bytes=len(output), options=self.options))
     def render(self, name, value, attrs=None):
+        if not self.use_cache():
+            return self._render(name, value, attrs)
+
+        attrs = attrs or {}
+        map_id = attrs.get('id', "id_%s" % id(self))
+        key = cache.make_key(self.options.get('cache_tag'),
+                self.get_cache_parts(name, value))
+        output = cache.get(key)
+        if output is None:
+            output = self._render(name, value,
+                    dict(attrs, id=cache.MAP_ID_PLACEHOLDER))
+            cache.set(key, output, self.options['cache_timeout'])
+        return mark_safe(output.replace(cache.MAP_ID_PLACEHOLDER,
+                                        escape(map_id)))
+
+    def stream(self, name, value, attrs=None):
+        """
+        Like ``render``, but return an iterator over the output in chunks.
+        Layers' info is encoded as it is written, so that large layers are
+        never held in memory as a whole.  Use it as the content of a
+        ``StreamingHttpResponse``.  Maps which use the render cache are
+        rendered in one chunk, through it.  Instrumentation events for the
+        map and its layers are emitted once the output has been read to the
+        end.
+        """
+        if self.use_cache():
+            return iter([self.render(name, value, attrs)])
+        return self._stream(name, value, attrs)
+
+    def use_cache(self):
+        """
+        Return whether to use the render cache: if the ``cache_timeout``
+        option is set, unless a layer's info would have to be read to build
+        the cache key, as for callables and other lazy info without a
+        ``cache_key`` option.
+        """
+        if not self.options.get('cache_timeout'):
+            return False
+        return (self.options.get('cache_key') is not None or
+                not any(layer.has_lazy_data() for layer in self.vector_layers))
+
+    def _stream(self, name, value, attrs):
+        collecting = bool(instrumentation.collectors)
+        if collecting:
+            start = instrumentation.timer()
+        token = uuid.uuid4().hex
+        streams = []
+        parts = re.split(STREAM_PLACEHOLDER_RE % token,
+                         self._render(name, value, attrs, streams, token))
+        bootstrap = self._bootstrap()
+        output_bytes = len(parts[0])
+        yield parts[0]
+        for i in range(1, len(parts), 2):
+            stream = streams[int(parts[i])]
+            for chunk in _timed_chunks(stream):
+                if bootstrap:
+                    # As in _render, "</script>" mustn't end the data block.
+                    chunk = chunk.replace("</", "<\\/")
+                stream['output_bytes'] += len(chunk)
+                output_bytes += len(chunk)
+                yield chunk
+            output_bytes += len(parts[i + 1])
+            yield parts[i + 1]
+
+        if collecting:
+            for stream in streams:
+                layer = stream['layer']
+                features, vertices = layer.get_size(stream['value'])
+                instrumentation.emit(
+                        "%s.prepare" % layer.__class__.__name__,
+                        instrumentation.timer() - stream['seconds'],
+                        features=features, vertices=vertices,
+                        output_bytes=stream['output_bytes'],
+                        options=layer.options)
+            features, vertices = self.get_size(value)
+            instrumentation.emit("Map.render", start, features=features,
+                    vertices=vertices, output_bytes=output_bytes,
+                    options=self.options)
+
+    def get_cache_parts(self, name, value):
+        """
+        Return the data which determines this map's rendered output, apart
+        from its html id, for use in its render cache key.  With a
+        ``cache_key`` option, it stands in for the value and the layers' data,
+        which aren't read.
+        """
+        data_key = self.options.get('cache_key')
+        parts = [
+            self.__class__.__name__, self.template, name,
+            value if data_key is None else data_key,
+            self.options, self._get_layer_names(name), self.custom_layer_types,
+            self.get_extra_context(),
+        ]
+        for layer in self.vector_layers:
+            parts.extend(layer.get_cache_parts())
+            if data_key is None:
+                parts.extend(layer.get_data_cache_parts())
+        return parts
+
+    def get_size(self, value):
+        """
+        Return ``(features, vertices)`` for the map's layers, with the given
+        value, for instrumentation.
+        """
+        features = vertices = 0
+        for layer, layer_value in zip(self.vector_layers,
+                                      self._get_layer_values(value)):
+            layer_features, layer_vertices = layer.get_size(layer_value)
+            features += layer_features
+            vertices += layer_vertices
+        return (features, vertices)
+
+    def _get_layer_values(self, value):
+        """
+        Return the value for each layer; the map's values are those of its
+        editable layers, in order.
+        """
         if value is None:
             values = [None for i in range(len(self.vector_layers))]
         elif not isinstance(value, (list, tuple)):
             values = [value]
         else:
             values = value
+        layer_values = []
+        value_count = 0
+        for layer in self.vector_layers:
+            if layer.editable:
+                layer_values.append(values[value_count])
+                value_count += 1
+            else:
+                layer_values.append(None)
+        return layer_values
+
+    def _bootstrap(self):
+        # In bootstrap mode, render the map as JSON data, which olwidget.js
+        # finds and initializes on page load, rather than as a script.
+        return bool(self.options.get('bootstrap') and all(
+                layer.supports_bootstrap for layer in self.vector_layers))
+
+    def _render(self, name, value, attrs=None, streams=None, token=None):
+        """
+        Render the map.  If ``streams`` is a list, layers' javascript is
+        rendered as placeholders with the given ``token``, and a dict for
+        each layer, with its ``chunks``, is added to it.
+        """
         attrs = attrs or {}
         # Get an arbitrary unique ID if we weren't handed one (e.g. widget used
         # outside of a form).
         map_id = attrs.get('id', "id_%s" % id(self))
+        bootstrap = self._bootstrap()
 
         layer_js = []
         layer_html = []
         layer_names = self._get_layer_names(name)
-        value_count = 0
+        layer_values = self._get_layer_values(value)
+        collecting = bool(instrumentation.collectors)
         for i, layer in enumerate(self.vector_layers):
-            if layer.editable:
-                value = values[value_count]
-                value_count += 1
-            else:
-                value = None
+            value = layer_values[i]
             lyr_name = layer_names[i]
             id_ = "%s_%s" % (map_id, lyr_name)
+            if collecting:
+                start = instrumentation.timer()
             # Use "prepare" rather than "render" to get both js and html
-            (js, html) = layer.prepare(lyr_name, value, attrs={'id': id_ })
+            if streams is not None:
+                (chunks, html) = layer.prepare_stream(lyr_name, value,
+                        attrs={'id': id_ }, bootstrap=bootstrap)
+                js = STREAM_PLACEHOLDER % (token, len(streams))
+                streams.append({
+                    'layer': layer, 'value': value, 'chunks': chunks,
+                    'output_bytes': len(html),
+                    'seconds': instrumentation.timer() - start
+                               if collecting else 0,
+                })
+            elif bootstrap:
+                (js, html) = layer.prepare_json(lyr_name, value,
+                                                attrs={'id': id_ })
+            else:
+                (js, html) = layer.prepare(lyr_name, value, attrs={'id': id_ })
+            if collecting and streams is None:
+                features, vertices = layer.get_size(value)
+                instrumentation.emit(
+                        "%s.prepare" % layer.__class__.__name__, start,
+                        features=features, vertices=vertices,
+                        output_bytes=len(js) + len(html),
+                        options=layer.options)
             layer_js.append(js)
             layer_html.append(html)
 
+        map_opts = self._options_json.encode(
+                utils.client_options(self.options))
         context = {
             'id': map_id,
             'layer_js': layer_js,
             'layer_html': layer_html,
-            'map_opts': json.dumps(utils.translate_options(self.options)),
+            'map_opts': map_opts,
             'setup_custom_layer_types': self._custom_layer_types_js(),
             'STATIC_URL': settings.STATIC_URL,
         }
+        if bootstrap:
+            map_json = '{"id": %s, "layers": [%s], "options": %s' % (
+                    json.dumps(map_id), ", ".join(layer_js), map_opts)
+            layer_types = self._used_custom_layer_types()
+            if layer_types:
+                map_json += ', "customLayerTypes": %s' % json.dumps(
+                        layer_types)
+            map_json += '}'
+            # Don't let "</script>" in popup html end the data block.
+            context['map_json'] = map_json.replace("</", "<\\/")
         context.update(self.get_extra_context())
         return render_to_string(self.template, context)
 
@@ -120,11 +306,21 @@ class Map(forms.Widget):
 
     def _custom_layer_types_js(self):
         layer_types_js = ""
-        for typename in self.custom_layer_types:
-            js_def = self.custom_layer_types[typename]
+        layer_types = self._used_custom_layer_types()
+        for typename in layer_types:
+            js_def = layer_types[typename]
             layer_types_js += "olwidget.%s = {map: function() { return new %s }};" % (typename, js_def)
         return layer_types_js
 
+    def _used_custom_layer_types(self):
+        """
+        Return the custom layer types which this map's ``layers`` option
+        refers to, so that each map doesn't repeat all of them.
+        """
+        used = set(layer.split('.')[0] for layer in self.options['layers'])
+        return dict((typename, js_def) for typename, js_def
+                    in self.custom_layer_types.iteritems() if typename in used)
+
     def _get_layer_names(self, name):
         """ 
         If the user gave us a layer_names parameter, use that.  Otherwise,
@@ -135,49 +331,60 @@ class Map(forms.Widget):
             return self.layer_names
 
         singleton = len(self.vector_layers.editable) == 1
-        self.layer_names = []
+        layer_names = []
         for i,layer in enumerate(self.vector_layers):
             if singleton and layer.editable:
-                self.layer_names.append("%s" % name)
+                layer_names.append("%s" % name)
             else:
-                self.layer_names.append("%s_%i" % (name, i))
-        return self.layer_names
+                layer_names.append("%s_%i" % (name, i))
+        return layer_names
 
+    @instrumentation.instrumented("Map._has_changed",
+            lambda changed, self, initial, data: dict(
+                instrumentation.measure_input(data), options=self.options))
     def _has_changed(self, initial, data):
         if (initial is None) or (not isinstance(initial, (tuple, list))):
             initial = [u''] * len(data)
         for widget, initial, data in zip(self.vector_layers, initial, data):
-            if utils.get_geos(initial) != utils.get_geos(data):
+            if utils.geometry_changed(initial, data,
+                    tolerance=widget.get_option('change_tolerance', 0)):
                 return True
         return False
 
     def _media(self):
+        conf = utils.olwidget_settings
         js = set()
         # collect scripts necessary for various base layers
         for layer in self.options['layers']:
             if layer.startswith("osm."):
-                js.add(settings.OSM_API)
+                js.add(conf.OSM_API)
             elif layer.startswith("google."):
-                GOOGLE_API_URL = settings.GOOGLE_API
-                if settings.GOOGLE_API_KEY:
-                    GOOGLE_API_URL += "&key=%s" % settings.GOOGLE_API_KEY
+                GOOGLE_API_URL = conf.GOOGLE_API
+                if conf.GOOGLE_API_KEY:
+                    GOOGLE_API_URL += "&key=%s" % conf.GOOGLE_API_KEY
                 js.add(GOOGLE_API_URL)
             elif layer.startswith("yahoo."):
-                js.add(settings.YAHOO_API + "&appid=%s" % settings.YAHOO_APP_ID)
+                js.add(conf.YAHOO_API + "&appid=%s" % conf.YAHOO_APP_ID)
             elif layer.startswith("ve."):
-                js.add(settings.MS_VE_API)
+                js.add(conf.MS_VE_API)
             elif layer.startswith("cloudmade."):
-                js.add(settings.CLOUDMADE_API + "#" + settings.CLOUDMADE_API_KEY)
-        js = [settings.OL_API, settings.OLWIDGET_JS] + list(js)
-        return forms.Media(css={'all': (settings.OLWIDGET_CSS,)}, js=js)
+                js.add(conf.CLOUDMADE_API + "#" + conf.CLOUDMADE_API_KEY)
+        js = [conf.OL_API, conf.OLWIDGET_JS] + list(js)
+        return forms.Media(css={'all': (conf.OLWIDGET_CSS,)}, js=js)
     media = property(_media)
 
     def __unicode__(self):
         return self.render(None, None)
 
     def __deepcopy__(self, memo):
+        # Django copies widgets for each form instance.  Rendering doesn't
+        # change the map or its layers, so only the options are copied, for
+        # changes made to a single form's widget.
         obj = super(Map, self).__deepcopy__(memo)
-        obj.vector_layers = copy.deepcopy(self.vector_layers)
+        obj.options = self.options.copy()
+        obj.vector_layers = copy.deepcopy(self.vector_layers, memo)
+        for layer in obj.vector_layers:
+            layer.map_options = obj.options
         return obj
 
 class VectorLayerList(list):
@@ -198,7 +405,7 @@ class VectorLayerList(list):
     def __deepcopy__(self, memo):
         obj = VectorLayerList()
         for thing in self:
-            obj.append(copy.deepcopy(thing))
+            obj.append(copy.deepcopy(thing, memo))
         return obj
 
 #
@@ -207,6 +414,22 @@ class VectorLayerList(list):
 
 class BaseVectorLayer(forms.Widget):
     editable = False
+    # Whether the layer implements ``prepare_json``.
+    supports_bootstrap = False
+    # Options of the containing Map; set by Map.__init__.
+    map_options = None
+
+    def get_option(self, key, default=None):
+        """
+        Return this layer's value for option ``key``, falling back to the
+        containing map's options and then to the default options.
+        """
+        if key in self.options:
+            return self.options[key]
+        if self.map_options is not None:
+            return self.map_options.get(key, default)
+        return utils.get_options(None).get(key, default)
+
     def prepare(self, name, value, attrs=None):
         """
         Given the name, value and attrs, prepare both html and javascript
@@ -215,6 +438,26 @@ class BaseVectorLayer(forms.Widget):
         """
         raise NotImplementedError
 
+    def prepare_json(self, name, value, attrs=None):
+        """
+        Like ``prepare``, but returns a JSON object describing the layer for
+        olwidget.js's bootstrap in place of javascript.  The object has a
+        ``type`` key with the olwidget.js layer type.
+        """
+        raise NotImplementedError
+
+    def prepare_stream(self, name, value, attrs=None, bootstrap=False):
+        """
+        Like ``prepare``, or ``prepare_json`` if ``bootstrap`` is True, but
+        return an iterable of chunks of the javascript (or JSON) in place of
+        a string.
+        """
+        if bootstrap:
+            (js, html) = self.prepare_json(name, value, attrs)
+        else:
+            (js, html) = self.prepare(name, value, attrs)
+        return ([js], html)
+
     def render(self, name, value, attrs=None):
         """
         Return just the javascript component of this widget.  To also get the
@@ -223,6 +466,35 @@ class BaseVectorLayer(forms.Widget):
         (javascript, html) = self.prepare(name, value, attrs)
         return javascript
 
+    def get_cache_parts(self):
+        """
+        Return the configuration which determines this layer's output for a
+        given name and value, for use in render cache keys.
+        """
+        return [self.__class__.__name__, self.template, self.options,
+                self.get_extra_context()]
+
+    def get_data_cache_parts(self):
+        """
+        Return the layer's data for use in render cache keys, when no
+        ``cache_key`` option identifies it.
+        """
+        return []
+
+    def has_lazy_data(self):
+        """
+        Return whether the layer's data is only read when it is rendered, so
+        that it can't be read for cache keys.
+        """
+        return False
+
+    def get_size(self, value):
+        """
+        Return ``(features, vertices)`` for this layer with the given value,
+        for instrumentation.
+        """
+        return instrumentation.measure_geometries([value])
+
     def get_extra_context(self):
         """Hook that subclasses can override to add extra data for use
         by the javascript in self.template. This should be invoked by
@@ -238,37 +510,96 @@ class BaseVectorLayer(forms.Widget):
     def __unicode__(self):
         return self.render(None, None)
 
+    def __deepcopy__(self, memo):
+        # Layer data, such as an InfoLayer's info, is shared between copies;
+        # it is treated as immutable.
+        obj = super(BaseVectorLayer, self).__deepcopy__(memo)
+        obj.options = self.options.copy()
+        return obj
+
 class InfoLayer(BaseVectorLayer):
     """
     A wrapper for the javscript olwidget.InfoLayer() type.  Takes an an array
     [geometry, html] pairs, where the html will be the contents of a popup
     displayed over the geometry, and an optional options dict.  Intended for
     use as a sub-widget for a ``Map`` widget.
+
+    ``info`` may also be a callable returning the pairs, or any other
+    iterable of them, such as a ``QuerySetInfo`` or a generator; these are
+    only evaluated when the layer is rendered, and are read as a stream.  A
+    generator can only be rendered once.
     """
     default_template = 'olwidget/info_layer.html'
+    supports_bootstrap = True
 
     def __init__(self, info=None, options=None, template=None):
-        self.info = info or []
+        if isinstance(info, QuerySet):
+            raise TypeError("InfoLayer info can't be a QuerySet; wrap it in "
+                            "a QuerySetInfo.")
+        self.info = [] if info is None else info
         self.options = options or {}
         self.template = template or self.default_template
+        self._options_json = utils.OptionsJSON()
+        # (before, after) vertex counts from the last simplified prepare().
+        self.vertex_counts = None
         super(InfoLayer, self).__init__()
 
     def prepare(self, name, value, attrs=None):
-        wkt_array = []
-        for geom, attr in self.info:
-            wkt = utils.get_ewkt(geom)
-            if isinstance(attr, dict):
-                wkt_array.append([wkt, utils.translate_options(attr)])
-            else:
-                wkt_array.append([wkt, attr])
-        info_json = json.dumps(wkt_array)
+        if not self.use_cache():
+            return self._prepare(name, value, attrs)
 
-        if name and not self.options.has_key('name'):
-            self.options['name'] = forms.forms.pretty_name(name)
+        parts = [name, self.map_options]
+        parts.extend(self.get_cache_parts())
+        if self.get_option('cache_key') is None:
+            parts.extend(self.get_data_cache_parts())
+        key = cache.make_key(self.get_option('cache_tag'), parts)
+        prepared = cache.get(key)
+        if prepared is None:
+            prepared = self._prepare(name, value, attrs)
+            cache.set(key, prepared, self.get_option('cache_timeout'))
+        return prepared
 
+    def use_cache(self):
+        """
+        Return whether to use the render cache: if the ``cache_timeout``
+        option is set, unless the info is lazy and has no ``cache_key``.
+        """
+        if not self.get_option('cache_timeout'):
+            return False
+        return (self.get_option('cache_key') is not None or
+                not self.has_lazy_data())
+
+    def has_lazy_data(self):
+        return not isinstance(self.info, (list, tuple))
+
+    def get_data_cache_parts(self):
+        parts = []
+        for geom, attr in self.iter_info():
+            parts.append(geom)
+            parts.append(attr)
+        return parts
+
+    def get_size(self, value):
+        # Info which is evaluated on rendering isn't read again to count it.
+        if self.has_lazy_data():
+            return (0, 0)
+        return instrumentation.measure_geometries(
+                geom for geom, attr in self.info)
+
+    def iter_info(self):
+        """
+        Return an iterable of the layer's (geometry, attr) pairs, calling
+        ``info`` if it is callable.
+        """
+        if callable(self.info):
+            return self.info()
+        return self.info
+
+    def _prepare(self, name, value, attrs=None):
+        info_json = json.dumps(self.get_info_array())
         context = {
             'info_array': info_json,
-            'options': json.dumps(utils.translate_options(self.options)),
+            'options': self._get_options_json(name),
             'STATIC_URL': settings.STATIC_URL,
         }
         context.update(self.get_extra_context())
@@ -276,6 +607,339 @@ class InfoLayer(BaseVectorLayer):
         html = ""
         return (js, html)
 
+    def prepare_json(self, name, value, attrs=None):
+        data = '{"type": "InfoLayer", "info": %s, "options": %s}' % (
+                json.dumps(self.get_info_array()),
+                self._get_options_json(name))
+        return (data, "")
+
+    def prepare_stream(self, name, value, attrs=None, bootstrap=False):
+        if self.use_cache():
+            return super(InfoLayer, self).prepare_stream(name, value, attrs,
+                                                         bootstrap)
+        options = self._get_options_json(name)
+        if bootstrap:
+            before = '{"type": "InfoLayer", "info": '
+            after = ', "options": %s}' % options
+        else:
+            placeholder = INFO_PLACEHOLDER % uuid.uuid4().hex
+            context = {
+                'info_array': placeholder,
+                'options': options,
+                'STATIC_URL': settings.STATIC_URL,
+            }
+            context.update(self.get_extra_context())
+            parts = render_to_string(self.template, context).split(
+                    placeholder)
+            if len(parts) != 2:
+                # A custom template which doesn't show the info just once.
+                return super(InfoLayer, self).prepare_stream(name, value,
+                                                             attrs, bootstrap)
+            before, after = parts
+        return (itertools.chain([before], self.iter_info_json(), [after]), "")
+
+    def iter_info_json(self):
+        """
+        Yield the JSON encoding of ``get_info_array()`` in chunks of
+        ``STREAM_CHUNK_SIZE`` features, encoding the info as it is read
+        rather than building the whole array first.
+        """
+        if self.get_option('server_cluster'):
+            yield json.dumps(self.get_info_array())
+            return
+        started = False
+        chunk = []
+        for item in self.iter_info_array():
+            chunk.append(json.dumps(item))
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                yield (", " if started else "[") + ", ".join(chunk)
+                started = True
+                chunk = []
+        if chunk:
+            yield (", " if started else "[") + ", ".join(chunk)
+            started = True
+        yield "]" if started else "[]"
+
+    def _get_options_json(self, name):
+        options = utils.client_options(self.options)
+        if name and not options.has_key('name'):
+            options['name'] = forms.forms.pretty_name(name)
+        # Always tell olwidget.js how geometries were encoded, in case the
+        # encoding came from the default options.
+        options['geometry_encoding'] = self.get_option(
+                'geometry_encoding', 'wkt')
+        if self.get_option('precision') is not None:
+            options['precision'] = self.get_option('precision')
+        return self._options_json.encode(options)
+
+    def get_info_array(self):
+        """
+        Return the layer's info as a list of ``[geometry, attr]`` pairs ready
+        for JSON encoding, with geometries serialized according to the
+        ``geometry_encoding`` and ``precision`` options.
+        """
+        if self.get_option('server_cluster'):
+            return self.get_cluster_data()
+        return list(self.iter_info_array())
+
+    def iter_info_array(self):
+        """
+        Yield the items of ``get_info_array()`` without clustering, one at a
+        time.
+        """
+        encoding = self.get_option('geometry_encoding')
+        precision = self.get_option('precision')
+        for geom, attr in self.get_info():
+            geom = utils.encode_geometry(geom, encoding, precision)
+            if isinstance(attr, dict):
+                yield [geom, utils.translate_options(attr)]
+            else:
+                yield [geom, attr]
+
+    def get_cluster_data(self):
+        """
+        Return the layer's info clustered for each zoom level, for the
+        ``server_cluster`` option, as a dict ready for JSON encoding.  Each
+        geometry is represented by its centroid.  Popup html is included in
+        cluster order, unless the ``cluster_html_url`` option is set, in
+        which case the info's attrs are keys for fetching html from the URL.
+        """
+        points = []
+        for geom, attr in self.iter_info():
+            geom = utils.get_geos(geom)
+            if geom:
+                points.append((geom.centroid, attr))
+        x, y = utils.transform_coordinates([p.x for p, attr in points],
+                                           [p.y for p, attr in points],
+                                           utils.DEFAULT_PROJ, 900913)
+        order, levels = utils.grid_clusters(x, y,
+                max_zoom=self.get_option('server_cluster_max_zoom', 18),
+                distance=self.get_option('server_cluster_distance', 20))
+        precision = self.get_option('precision')
+        data = {
+            'srid': 900913,
+            'zooms': [{
+                'x': utils.encode_column([c[0] for c in level], precision),
+                'y': utils.encode_column([c[1] for c in level], precision),
+                'count': [c[2] for c in level],
+            } for level in levels],
+        }
+        attrs = [points[i][1] for i in order]
+        if self.get_option('cluster_html_url'):
+            data['keys'] = attrs
+        else:
+            data['html'] = [utils.translate_options(attr)
+                            if isinstance(attr, dict) else attr
+                            for attr in attrs]
+        return data
+
+    def get_info(self):
+        """
+        Return an iterable of the (geometry, attr) pairs to render,
+        simplified according to the ``simplify`` and ``max_vertices``
+        options.
+        """
+        simplify = self.get_option('simplify')
+        max_vertices = self.get_option('max_vertices')
+        if not (simplify or max_vertices):
+            return self.iter_info()
+
+        info = ((utils.get_geos(geom), attr)
+                for geom, attr in self.iter_info())
+        if simplify is True:
+            zoom = self.get_option('default_zoom')
+            extent = None
+            if zoom is None:
+                # The tolerance depends on the extent of all the geometries,
+                # so they have to be read first.
+                info = list(info)
+                extent = _info_extent(geom for geom, attr in info)
+            tolerance = utils.simplify_tolerance(zoom, extent)
+        else:
+            tolerance = simplify or None
+        return self._simplify_info(info, tolerance, max_vertices)
+
+    def _simplify_info(self, info, tolerance, max_vertices):
+        before = after = 0
+        for geom, attr in info:
+            if geom:
+                before += geom.num_coords
+                geom = utils.simplify(geom, tolerance, max_vertices)
+                after += geom.num_coords
+            yield (geom, attr)
+        self.vertex_counts = (before, after)
+
+def _info_extent(geoms):
+    """ Return the combined (xmin, ymin, xmax, ymax) extent of ``geoms``. """
+    extent = None
+    for geom in geoms:
+        if not geom:
+            continue
+        e = geom.extent
+        if extent is None:
+            extent = e
+        else:
+            extent = (min(extent[0], e[0]), min(extent[1], e[1]),
+                      max(extent[2], e[2]), max(extent[3], e[3]))
+    return extent
+
+class QuerySetInfo(object):
+    """
+    Info for an ``InfoLayer`` from the objects in ``queryset``, which is
+    read each time the layer is rendered, streaming the objects from the
+    database.  Each object's geometry is the collection of its geometry
+    fields named in ``fields``, and its popup html is given by ``html``: the
+    name of an attribute, a function of the object, or by default the
+    object's unicode representation.  Objects without a geometry are left
+    out.
+    """
+    def __init__(self, queryset, fields, html=None):
+        if isinstance(fields, basestring):
+            fields = [fields]
+        self.queryset = queryset
+        self.fields = fields
+        self.html = html
+
+    def __iter__(self):
+        for obj in self.queryset.iterator():
+            geoms = [getattr(obj, field) for field in self.fields]
+            geoms = [geom for geom in geoms if geom]
+            if not geoms:
+                continue
+            if callable(self.html):
+                attr = self.html(obj)
+            elif self.html:
+                attr = getattr(obj, self.html)
+            else:
+                attr = force_unicode(obj)
+            yield (utils.collection_ewkt(geoms), attr)
+
+class BBoxInfoLayer(InfoLayer):
+    """
+    An InfoLayer whose info is fetched by olwidget.js from ``url`` as the map
+    is moved, for just the current viewport (plus a margin).  The URL is
+    passed a ``bbox`` parameter, ``xmin,ymin,xmax,ymax`` in the map's
+    projection, with that projection's ``srid`` and the ``zoom``;
+    ``olwidget.views.info_layer_data`` serves such requests from a queryset.
+    """
+    def __init__(self, url, options=None, template=None):
+        options = dict(options or {})
+        options['bbox_url'] = url
+        super(BBoxInfoLayer, self).__init__(None, options, template)
+
+    def get_info_array(self):
+        return []
+
+    def iter_info_array(self):
+        return iter([])
+
+class TileInfoLayer(InfoLayer):
+    """
+    An InfoLayer whose info is fetched by olwidget.js one tile at a time, as
+    the map is moved.  ``url`` is a template in which ``{z}``, ``{x}`` and
+    ``{y}`` are replaced with the address of each tile in the spherical
+    mercator grid used by OpenStreetMap and Google;
+    ``olwidget.views.info_layer_tile`` serves such requests from a queryset.
+    """
+    def __init__(self, url, options=None, template=None):
+        options = dict(options or {})
+        options['tile_url'] = url
+        super(TileInfoLayer, self).__init__(None, options, template)
+
+    def get_info_array(self):
+        return []
+
+    def iter_info_array(self):
+        return iter([])
+
+class ColumnarInfoLayer(InfoLayer):
+    """
+    An InfoLayer for large numbers of points or linestrings, given as
+    sequences of coordinates rather than as geometries.  ``x`` and ``y`` hold
+    the coordinates in the projection ``srid``, and ``attrs`` the popup html
+    (or attribute dict) for each feature.  For linestrings, ``offsets`` holds
+    the index of each feature's first vertex, plus the total vertex count.
+
+    Coordinates are reprojected in bulk (vectorized, if NumPy is installed)
+    to the map's projection, and sent to olwidget.js as columns.
+    """
+    def __init__(self, x, y, attrs=None, offsets=None, srid=utils.DEFAULT_PROJ,
+            options=None, template=None):
+        self.x = x
+        self.y = y
+        # Not ``self.attrs``, which forms.Widget uses for html attributes.
+        self.html = attrs
+        self.offsets = offsets
+        self.srid = int(srid)
+        super(ColumnarInfoLayer, self).__init__(None, options, template)
+
+    @classmethod
+    def from_queryset(cls, queryset, field_name, html=None, options=None,
+            template=None):
+        """
+        Create a layer from the point or linestring field ``field_name`` of
+        the objects in ``queryset``.  ``html``, if given, is a function
+        returning the popup html for an object.
+        """
+        x, y, attrs = [], [], []
+        offsets = None
+        field = queryset.model._meta.get_field(field_name)
+        if field.geom_type == 'LINESTRING':
+            offsets = [0]
+        for obj in queryset.iterator():
+            geom = getattr(obj, field_name)
+            if not geom:
+                continue
+            if offsets is None:
+                x.append(geom.x)
+                y.append(geom.y)
+            else:
+                for coord in geom.coords:
+                    x.append(coord[0])
+                    y.append(coord[1])
+                offsets.append(len(x))
+            attrs.append(html(obj) if html else "")
+        return cls(x, y, attrs, offsets, field.srid, options, template)
+
+    def get_data_cache_parts(self):
+        return [utils.encode_column(self.x), utils.encode_column(self.y),
+                self.html, self.offsets, self.srid]
+
+    def get_size(self, value):
+        if self.offsets is not None:
+            return (len(self.offsets) - 1, len(self.x))
+        return (len(self.x), len(self.x))
+
+    def get_info_array(self):
+        """
+        Return the layer's data as a dict of columns ready for JSON encoding.
+        """
+        srid = self.get_projection_srid()
+        x, y = utils.transform_coordinates(self.x, self.y, self.srid, srid)
+        precision = self.get_option('precision')
+        data = {
+            'srid': srid,
+            'x': utils.encode_column(x, precision),
+            'y': utils.encode_column(y, precision),
+        }
+        if self.html is not None:
+            data['html'] = [utils.translate_options(attr)
+                            if isinstance(attr, dict) else attr
+                            for attr in self.html]
+        if self.offsets is not None:
+            data['offsets'] = list(self.offsets)
+        return data
+
+    def iter_info_json(self):
+        # The columns are compact, so they're encoded in one chunk.
+        yield json.dumps(self.get_info_array())
+
+    def get_projection_srid(self):
+        """ Return the SRID of the map's projection. """
+        map_options = self.get_option('map_options') or {}
+        projection = map_options.get('projection', "EPSG:900913")
+        return int(projection.split(":")[-1])
+
 class EditableLayer(BaseVectorLayer):
     """
     A wrapper for the javascript olwidget.EditableLayer() type.  Intended for
@@ -283,23 +947,22 @@ class EditableLayer(BaseVectorLayer):
     """
     default_template = "olwidget/editable_layer.html"
     editable = True
+    supports_bootstrap = True
 
     def __init__(self, options=None, template=None):
         self.options = options or {}
         self.template = template or self.default_template
+        self._options_json = utils.OptionsJSON()
         super(EditableLayer, self).__init__()
 
     def prepare(self, name, value, attrs=None):
-        if not attrs:
-            attrs = {}
-        if name and not self.options.has_key('name'):
-            self.options['name'] = forms.forms.pretty_name(name)
+        attrs = dict(attrs or {})
         attrs['id'] = attrs.get('id', "id_%s" % id(self))
 
-        wkt = utils.get_ewkt(value)
+        wkt, options = self._get_value_and_options(name, value)
         context = {
             'id': attrs['id'],
-            'options': json.dumps(utils.translate_options(self.options)),
+            'options': options,
             'STATIC_URL': settings.STATIC_URL,
         }
         context.update(self.get_extra_context())
@@ -307,6 +970,33 @@ class EditableLayer(BaseVectorLayer):
         html = mark_safe(forms.Textarea().render(name, wkt, attrs))
         return (js, html)
 
+    def prepare_json(self, name, value, attrs=None):
+        attrs = dict(attrs or {})
+        attrs['id'] = attrs.get('id', "id_%s" % id(self))
+
+        wkt, options = self._get_value_and_options(name, value)
+        data = '{"type": "EditableLayer", "textareaId": %s, "options": %s}' % (
+                json.dumps(attrs['id']), options)
+        html = mark_safe(forms.Textarea().render(name, wkt, attrs))
+        return (data, html)
+
+    def _get_value_and_options(self, name, value):
+        """
+        Return the textarea value and the options JSON for ``value``.
+        """
+        options = utils.client_options(self.options)
+        if name and not options.has_key('name'):
+            options['name'] = forms.forms.pretty_name(name)
+        if isinstance(value, utils.GeometryDelta):
+            # Redisplaying submitted changes; olwidget.js applies them to the
+            # geometry they were made to.
+            options['delta_base'] = utils.get_ewkt(value.base)
+            options['delta_base_digest'] = utils.geometry_digest(value.base)
+            return (value.delta, self._options_json.encode(options))
+        if self.get_option('delta_submit'):
+            options['delta_base_digest'] = utils.geometry_digest(value)
+        return (utils.get_ewkt(value), self._options_json.encode(options))
+
 #
 # Convenience single layer widgets for use in non-MapField fields.
 #
@@ -345,9 +1035,26 @@ class MapDisplay(EditableMap):
     def __init__(self, fields=None, options=None, **kwargs):
         options = utils.get_options(options)
         options['editable'] = False
+        simplify = options.get('simplify')
+        max_vertices = options.get('max_vertices')
+        precision = options.get('precision')
         super(MapDisplay, self).__init__(options, **kwargs)
+        self.vertex_counts = None
         if fields:
-            self.wkt = utils.collection_ewkt(fields)
+            self.wkt = utils.collection_ewkt(fields, precision=precision)
+            geos = None
+            if simplify or max_vertices:
+                # None if all the fields are empty.
+                geos = utils.get_geos(self.wkt)
+            if geos:
+                if simplify is True:
+                    tolerance = utils.simplify_tolerance(
+                            options.get('default_zoom'), geos.extent)
+                else:
+                    tolerance = simplify
+                simplified = utils.simplify(geos, tolerance, max_vertices)
+                self.vertex_counts = (geos.num_coords, simplified.num_coords)
+                self.wkt = utils.get_ewkt(simplified, precision=precision)
         else:
             self.wkt = ""
 
@@ -0,0 +1,16 @@
+# Settings for running the olwidget benchmarks on a local SpatiaLite
+# database:
+#
+#   python manage.py olwidget_benchmark --settings=benchmark_settings
+
+from settings import *
+
+DEBUG = False
+TEMPLATE_DEBUG = DEBUG
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.contrib.gis.db.backends.spatialite',
+        'NAME': os.path.join(SETTINGS_ROOT, 'benchmark.db'),
+    }
+}
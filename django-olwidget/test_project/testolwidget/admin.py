@@ -105,6 +105,7 @@ class NullableAdmin(GeoModelAdmin):
         'map_div_style': { 'width': '300px', 'height': '200px' },
     }
     list_map = ['location']
+    list_map_chunk_size = 2
 admin.site.register(Nullable, NullableAdmin)
 
 class GoogProjAdmin(GeoModelAdmin):
@@ -0,0 +1,236 @@
+"""
+Benchmarks for olwidget's rendering and form handling hot paths.  Run them on
+a local SpatiaLite database, saving the results to compare between releases::
+
+    python manage.py olwidget_benchmark --settings=benchmark_settings \\
+            --output=olwidget-0.61.json
+
+    python manage.py olwidget_benchmark --settings=benchmark_settings \\
+            --compare=olwidget-0.61.json
+
+The benchmarks run in a freshly created test database, which is destroyed
+afterwards.  Peak memory is only recorded if ``tracemalloc`` (or its
+``pytracemalloc`` backport) is available.
+"""
+import datetime
+import gc
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import timeit
+from optparse import make_option
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point, Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.client import RequestFactory
+
+from olwidget import utils
+from olwidget.admin import GeoModelAdmin
+from olwidget.fields import MapField, EditableLayerField, InfoLayerField
+from olwidget.forms import MapModelForm, MapModelFormMetaclass
+from olwidget.widgets import (Map, EditableMap, EditableLayer, InfoLayer,
+        ColumnarInfoLayer)
+from testolwidget.models import Tree
+
+# Rows per insert, to stay under SQLite's limit on query parameters.
+INSERT_BATCH_SIZE = 100
+
+# Run in a fresh interpreter, so the time includes its start-up and that of
+# Django's forms and templates; compare it between runs rather than reading
+# it as olwidget's own import time.
+IMPORT_SCRIPT = "import django.forms, django.template.loader, olwidget.widgets"
+
+class Command(BaseCommand):
+    help = "Time olwidget's widget rendering and form round-trips."
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help="Write the results as JSON to this file."),
+        make_option('--compare', dest='compare', default=None,
+            help="Compare the results with a JSON file from an earlier run."),
+        make_option('--sizes', dest='sizes', default="1000,10000,100000",
+            help="Comma separated feature counts for the info layer and "
+                 "changelist benchmarks."),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+            help="Number of timed runs of each benchmark; the fastest is "
+                 "reported."),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(s) for s in options['sizes'].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a list of integers.")
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as fh:
+                previous = json.load(fh)['results']
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {}
+            for name, func in get_benchmarks(sizes):
+                results[name] = measure(func, options['repeat'])
+                self.stdout.write(format_result(name, results[name],
+                        previous and previous.get(name)) + "\n")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            report = {
+                'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'database': connection.settings_dict['ENGINE'],
+                'repeat': options['repeat'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+
+def measure(func, repeat):
+    """
+    Call ``func`` ``repeat`` times, and return the fastest and median wall
+    times in seconds, the peak memory allocated during a call in bytes, and
+    the size of its output in bytes.
+    """
+    times = []
+    for i in range(max(repeat, 1)):
+        gc.collect()
+        start = timeit.default_timer()
+        output = func()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+
+    peak_memory = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    output_bytes = None
+    if isinstance(output, unicode):
+        output_bytes = len(output.encode('utf-8'))
+    elif isinstance(output, str):
+        output_bytes = len(output)
+
+    return {
+        'wall_time': times[0],
+        'median_wall_time': times[len(times) // 2],
+        'peak_memory': peak_memory,
+        'output_bytes': output_bytes,
+    }
+
+def format_result(name, result, previous=None):
+    line = "%-45s %10.4fs" % (name, result['wall_time'])
+    if result['peak_memory'] is not None:
+        line += " %10.1fKB" % (result['peak_memory'] / 1024.0)
+    if result['output_bytes'] is not None:
+        line += " %10.1fKB out" % (result['output_bytes'] / 1024.0)
+    if previous:
+        line += "  (%.2fx time" % (result['wall_time'] / previous['wall_time'])
+        if result['peak_memory'] and previous.get('peak_memory'):
+            line += ", %.2fx memory" % (
+                    float(result['peak_memory']) / previous['peak_memory'])
+        line += ")"
+    return line
+
+def random_point(rand):
+    return Point(rand.uniform(-180, 180), rand.uniform(-85, 85), srid=4326)
+
+def random_polygon(rand, vertices):
+    x, y = rand.uniform(-170, 170), rand.uniform(-80, 80)
+    ring = [(x + math.cos(2 * math.pi * i / vertices),
+             y + math.sin(2 * math.pi * i / vertices))
+            for i in range(vertices)]
+    ring.append(ring[0])
+    return Polygon(ring, srid=4326)
+
+def get_benchmarks(sizes):
+    """
+    Yield ``(name, function)`` for each benchmark.  Data for each benchmark is
+    created lazily, so that only one benchmark's data is held at a time.
+    """
+    # Seeded, so that runs are comparable.
+    rand = random.Random(0)
+    polygon = random_polygon(rand, 1000)
+    point = random_point(rand)
+    ewkt = utils.get_ewkt(polygon)
+
+    yield ("import olwidget.widgets", lambda: subprocess.check_call(
+        [sys.executable, "-c", IMPORT_SCRIPT]))
+
+    yield ("Map.render", lambda: EditableMap({'geometry': 'polygon'}).render(
+        "root_spread", polygon, {'id': 'id_root_spread'}))
+
+    for size in sizes:
+        info = [(random_point(rand), "<p>Feature %i</p>" % i)
+                for i in range(size)]
+        yield ("InfoLayer.prepare[%i]" % size,
+               lambda info=info: InfoLayer(info).prepare("data", None)[0])
+        x = [geom.x for geom, attr in info]
+        y = [geom.y for geom, attr in info]
+        attrs = [attr for geom, attr in info]
+        yield ("ColumnarInfoLayer.prepare[%i]" % size,
+               lambda x=x, y=y, attrs=attrs: ColumnarInfoLayer(
+                   x, y, attrs).prepare("data", None)[0])
+    info = x = y = attrs = None
+
+    def make_form_class():
+        class Meta:
+            model = Tree
+        return MapModelFormMetaclass("TreeForm", (MapModelForm,), {
+            'Meta': Meta, '__module__': __name__})
+    # Fields are built on first use, so include that.
+    yield ("MapModelFormMetaclass", lambda: make_form_class().base_fields)
+
+    form_class = make_form_class()
+    tree = Tree(location=point, root_spread=polygon, species="Oak")
+    yield ("MapModelForm.__init__", lambda: form_class(instance=tree))
+
+    field = MapField([
+        EditableLayerField({'geometry': 'polygon'}),
+        InfoLayerField([(point, "Of interest")]),
+    ])
+    yield ("MapField.clean", lambda: field.clean([ewkt, ""]))
+
+    map_ = Map([EditableLayer({'geometry': 'polygon'})])
+    yield ("Map._has_changed", lambda: map_._has_changed([polygon], [ewkt]))
+
+    model_admin = GeoModelAdmin(Tree, admin.site)
+    model_admin.list_map = ['location']
+    request = RequestFactory().get("/admin/testolwidget/tree/")
+    request.user = User(username="admin", is_active=True, is_staff=True,
+                        is_superuser=True)
+    for size in sizes:
+        create_trees(rand, size)
+        response = super(GeoModelAdmin, model_admin).changelist_view(request)
+        cl = response.context_data['cl']
+        yield ("GeoModelAdmin.get_changelist_map[%i]" % size,
+               lambda cl=cl: model_admin.get_changelist_map(cl, request).render(
+                   "list_map", None, {'id': 'list_map'}))
+
+def create_trees(rand, count):
+    Tree.objects.all().delete()
+    for start in range(0, count, INSERT_BATCH_SIZE):
+        Tree.objects.bulk_create([
+            Tree(location=random_point(rand),
+                 root_spread=random_polygon(rand, 8),
+                 species="Tree %i" % i)
+            for i in range(start, min(start + INSERT_BATCH_SIZE, count))
+        ])
@@ -1,8 +1,18 @@
+import json
+
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.contrib import admin
 from django.contrib.auth.models import User
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+from django.utils.unittest import skipIf
 
-from testolwidget.models import GoogProjModel
+from olwidget import views as olwidget_views
+from olwidget.forms import BaseMapModelForm
+from olwidget.widgets import InfoLayer, InfoMap, QuerySetInfo
+from testolwidget.models import GoogProjModel, Nullable, Tree
 
 class TestGoogProjAdmin(TestCase):
     def setUp(self):
@@ -24,3 +34,192 @@ class TestGoogProjAdmin(TestCase):
         # Floating point comparison -- ensure distance is miniscule.
         self.assertTrue(a.distance(b) < 1.0e-9)
 
+    def test_form_cache(self):
+        model_admin = admin.site._registry[GoogProjModel]
+        request = RequestFactory().get('/admin/testolwidget/googprojmodel/add/')
+        request.user = User.objects.get(username='admin')
+        # Forms may depend on the request, so they aren't cached by default.
+        self.assertTrue(model_admin.get_form(request) is not
+                        model_admin.get_form(request))
+        model_admin.cache_forms = True
+        try:
+            form = model_admin.get_form(request)
+            self.assertTrue(form is model_admin.get_form(request))
+            self.assertTrue(form is not model_admin.get_form(request,
+                                                             fields=['point']))
+        finally:
+            model_admin.cache_forms = False
+        self.assertTrue(issubclass(form, BaseMapModelForm))
+        self.assertTrue('point' in form(instance=None).fields)
+
+
+class TestTiles(TestCase):
+    def setUp(self):
+        for x in (-10, 10):
+            Tree.objects.create(species="Oak",
+                location="SRID=4326;POINT(%i 10)" % x,
+                root_spread="SRID=4326;POLYGON((%i 9, %i 9, %i 11, %i 9))" % (
+                    x - 1, x + 1, x, x - 1))
+
+    def test_json_tile(self):
+        data = json.loads(self.client.get('/trees/0/0/0.json').content)
+        self.assertEquals(len(data['info']), 2)
+        self.assertEquals(len(set(data['ids'])), 2)
+        # Tile 1/1/0 is the north east quarter of the world.
+        data = json.loads(self.client.get('/trees/1/1/0.json').content)
+        self.assertEquals(len(data['info']), 1)
+        self.assertEquals(data['info'][0][1], "Oak")
+        self.assertEquals(self.client.get('/trees/1/2/0.json').status_code,
+                          404)
+
+    def test_filter_bbox(self):
+        # Geometries entirely within the bbox are included.
+        bbox = olwidget_views.parse_bbox("8,8,12,12")
+        for field in ('location', 'root_spread'):
+            trees = olwidget_views.filter_bbox(Tree.objects.all(), [field],
+                                               bbox)
+            self.assertEquals([tree.location.x for tree in trees], [10])
+
+    def test_tile_cache(self):
+        request = RequestFactory().get('/trees/0/0/0.json')
+        options = {'cache_timeout': 60}
+        def tile(queryset):
+            response = olwidget_views.info_layer_tile(request, queryset,
+                    'location', 0, 0, 0, options=options)
+            return json.loads(response.content)['info']
+        self.assertEquals(len(tile(Tree.objects.all())), 2)
+        # Tiles of different querysets are cached separately.
+        self.assertEquals(len(tile(Tree.objects.filter(
+                location__equals=Point(10, 10, srid=4326)))), 1)
+        self.assertEquals(tile(Tree.objects.none()), [])
+        with self.assertNumQueries(0):
+            self.assertEquals(len(tile(Tree.objects.all())), 2)
+
+    @skipIf(olwidget_views.mapbox_vector_tile is None,
+            "mapbox-vector-tile isn't installed")
+    def test_mvt_tile(self):
+        response = self.client.get('/trees/1/1/0.mvt')
+        self.assertEquals(response['Content-Type'],
+                          "application/vnd.mapbox-vector-tile")
+        layers = olwidget_views.mapbox_vector_tile.decode(response.content)
+        features = layers['tree']['features']
+        self.assertEquals(len(features), 1)
+        self.assertEquals(features[0]['properties'], {'species': "Oak"})
+        self.assertEquals(features[0]['id'], Tree.objects.get(
+                location__equals=Point(10, 10, srid=4326)).pk)
+
+class TestQuerySetInfo(TestCase):
+    def setUp(self):
+        for species in ("Oak", "Elm"):
+            Tree.objects.create(species=species,
+                    location="SRID=4326;POINT(0 0)",
+                    root_spread="SRID=4326;POLYGON((0 0,1 0,1 1,0 0))")
+
+    def test_render(self):
+        info = QuerySetInfo(Tree.objects.order_by('species'), 'location',
+                            html='species')
+        with self.assertNumQueries(1):
+            js = InfoLayer(info).prepare("trees", None)[0]
+        self.assertTrue('Elm' in js and 'Oak' in js)
+        self.assertRaises(TypeError, InfoLayer, Tree.objects.all())
+
+    def test_cache(self):
+        info = QuerySetInfo(Tree.objects.all(), 'location', html='species')
+        # Without a cache_key, the query isn't run to build a cache key, and
+        # the output isn't cached.
+        options = {'cache_timeout': 60}
+        for i in range(2):
+            with self.assertNumQueries(1):
+                InfoMap(info, options).render("trees", None)
+
+        options['cache_key'] = 'trees'
+        with self.assertNumQueries(1):
+            first = InfoMap(info, options).render("trees", None, {'id': 'a'})
+        with self.assertNumQueries(0):
+            second = InfoMap(info, options).render("trees", None, {'id': 'a'})
+        self.assertEquals(first, second)
+
+class TestChangelistMapChunks(TestCase):
+    def setUp(self):
+        u = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        u.set_password('admin')
+        u.save()
+        for i in range(3):
+            Nullable.objects.create(location="SRID=4326;POINT(%i 0)" % i)
+
+    def test_chunks(self):
+        c = self.client
+        self.assertTrue(c.login(username='admin', password='admin'))
+        r = c.get('/admin/testolwidget/nullable/')
+        self.assertEquals(r.status_code, 200)
+        self.assertTrue('dataUrl' in r.content)
+
+        url = '/admin/testolwidget/nullable/olwidget_map_data/'
+        first = Nullable.objects.order_by('pk')[1]
+        data = json.loads(c.get(url, {'after': first.pk}).content)
+        self.assertEquals(len(data['info']), 1)
+        self.assertEquals(data['next'], None)
+        self.assertEquals(c.get(url, {'after': 'x'}).status_code, 400)
+
+        # Chunks don't count the changelist's objects, as its page does.
+        with override_settings(DEBUG=True):
+            reset_queries()
+            c.get(url, {'after': first.pk})
+            self.assertFalse([q for q in connection.queries
+                              if 'COUNT(' in q['sql'].upper()])
+        self.assertEquals(c.get(url, {'nonsense__exact': '1'}).status_code,
+                          400)
+
+    def test_db_serialize(self):
+        model_admin = admin.site._registry[Nullable]
+        model_admin.list_map_db_serialize = True
+        try:
+            c = self.client
+            self.assertTrue(c.login(username='admin', password='admin'))
+            r = c.get('/admin/testolwidget/nullable/')
+            self.assertEquals(r.status_code, 200)
+            url = '/admin/testolwidget/nullable/olwidget_map_data/'
+            first = Nullable.objects.order_by('pk')[1]
+            data = json.loads(c.get(url, {'after': first.pk}).content)
+        finally:
+            model_admin.list_map_db_serialize = False
+        self.assertEquals(len(data['info']), 1)
+        geom = GEOSGeometry(data['info'][0][0])
+        self.assertEquals(geom.geom_type, 'GeometryCollection')
+        self.assertTrue(geom[0].distance(Point(2, 0)) < 1.0e-9)
+
+    def test_cluster_html(self):
+        c = self.client
+        self.assertTrue(c.login(username='admin', password='admin'))
+        pks = [n.pk for n in Nullable.objects.order_by('pk')[:2]]
+        url = '/admin/testolwidget/nullable/olwidget_map_html/'
+        html = json.loads(c.get(url, {
+            'keys': ",".join(str(pk) for pk in pks)}).content)
+        self.assertEquals(len(html), 2)
+        self.assertTrue('/admin/testolwidget/nullable/%s/' % pks[0] in html[0])
+
+        model_admin = admin.site._registry[Nullable]
+        model_admin.list_map_cluster_html_limit = 1
+        try:
+            response = c.get(url, {'keys': ",".join(str(pk) for pk in pks)})
+        finally:
+            model_admin.list_map_cluster_html_limit = 100
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(c.get(url, {'keys': 'x'}).status_code, 400)
+
+    def test_bbox(self):
+        c = self.client
+        self.assertTrue(c.login(username='admin', password='admin'))
+        url = '/admin/testolwidget/nullable/olwidget_map_bbox/'
+        data = json.loads(c.get(url, {'bbox': '-0.5,-1,1.5,1'}).content)
+        self.assertEquals(len(data['info']), 2)
+        self.assertFalse(data['truncated'])
+        self.assertEquals(c.get(url, {'bbox': 'nonsense'}).status_code, 400)
+
+        # The same bbox, in spherical mercator.
+        data = json.loads(c.get(url, {
+            'bbox': '-55660,-111326,166980,111326', 'srid': '900913',
+        }).content)
+        self.assertEquals(len(data['info']), 2)
+        self.assertEquals(c.get(url, {
+            'bbox': '-0.5,-1,1.5,1', 'srid': 'x'}).status_code, 400)
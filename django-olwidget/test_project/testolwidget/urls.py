@@ -13,5 +13,8 @@ urlpatterns = patterns('testolwidget.views',
     build_pattern("tree_custom", "edit"),
     url("^capitals/edit$", "edit_capitals", name="edit_capitals"),
     url("^countries$", "show_countries", name="show_countries"),
+    url("^trees$", "show_trees", name="show_trees"),
+    url("^trees/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<format>json|mvt)$",
+        "tree_tile", name="tree_tile"),
     url("^$", "index", name="index"),
 )
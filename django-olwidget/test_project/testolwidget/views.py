@@ -4,7 +4,9 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect
 from django.conf import settings
 
-from olwidget.widgets import Map, EditableLayer, InfoLayer, InfoMap
+from olwidget.views import info_layer_tile
+from olwidget.widgets import Map, EditableLayer, InfoLayer, InfoMap, \
+        TileInfoLayer
 
 from testolwidget.models import *
 from testolwidget.forms import AlienActivityForm, CustomTreeForm, \
@@ -119,6 +121,17 @@ def show_countries(request):
         "edit_link": "/admin/testolwidget/country/",
     }, context_instance=RequestContext(request))
 
+def show_trees(request):
+    map_ = Map([TileInfoLayer("/trees/{z}/{x}/{y}.json", {'cluster': True})])
+    return render_to_response("testolwidget/show_obj.html", {
+        'obj': "Trees", "map": map_,
+        "edit_link": "/admin/testolwidget/tree/",
+    }, context_instance=RequestContext(request))
+
+def tree_tile(request, z, x, y, format):
+    return info_layer_tile(request, Tree.objects.all(), 'location', z, x, y,
+            format=format, attributes=['species'])
+
 def index(request):
     return render_to_response("testolwidget/index.html", {
             'map': Map([ 
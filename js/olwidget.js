@@ -17,6 +17,86 @@ var olwidget = {
         }
         return this.wktFormat.read(wkt);
     },
+    /*
+     * Decoding of the compact geometry encodings produced by
+     * olwidget.utils.encode_geometry.
+     */
+    geojsonFormat: new OpenLayers.Format.GeoJSON(),
+    decodeGeometry: function(geom, encoding, precision) {
+        // Returns a feature, or an array of features for collections, like
+        // ewktToFeature.
+        if (!encoding || encoding == 'wkt') {
+            return this.ewktToFeature(geom);
+        }
+        if (!geom) {
+            return undefined;
+        }
+        if (encoding == 'polyline') {
+            geom = this.decodePolylineGeometry(geom,
+                precision === undefined ? 5 : precision);
+        }
+        var geometry = this.geojsonFormat.read(geom, "Geometry");
+        if (geometry.CLASS_NAME == "OpenLayers.Geometry.Collection") {
+            var features = [];
+            for (var i = 0; i < geometry.components.length; i++) {
+                features.push(new OpenLayers.Feature.Vector(
+                    geometry.components[i]));
+            }
+            return features;
+        }
+        return new OpenLayers.Feature.Vector(geometry);
+    },
+    decodePolylineGeometry: function(geom, precision) {
+        // Convert a GeoJSON geometry whose coordinate sequences are encoded
+        // polylines back into plain GeoJSON.
+        if (geom.type == "GeometryCollection") {
+            var geometries = [];
+            for (var i = 0; i < geom.geometries.length; i++) {
+                geometries.push(this.decodePolylineGeometry(
+                    geom.geometries[i], precision));
+            }
+            return {type: geom.type, geometries: geometries};
+        }
+        var decode = function(coords) {
+            if (typeof coords === "string") {
+                return olwidget.decodePolyline(coords, precision);
+            }
+            var decoded = [];
+            for (var i = 0; i < coords.length; i++) {
+                decoded.push(decode(coords[i]));
+            }
+            return decoded;
+        };
+        var coordinates = decode(geom.coordinates);
+        if (geom.type == "Point") {
+            coordinates = coordinates[0];
+        }
+        return {type: geom.type, coordinates: coordinates};
+    },
+    decodePolyline: function(str, precision) {
+        // Decode a string of zigzag varint coordinate deltas.  Uses
+        // arithmetic rather than bitwise operators, which would overflow at
+        // 32 bits for projected coordinates.
+        var factor = Math.pow(10, precision);
+        var coords = [];
+        var index = 0, x = 0, y = 0;
+        while (index < str.length) {
+            var values = [];
+            for (var j = 0; j < 2; j++) {
+                var result = 0, multiplier = 1, b;
+                do {
+                    b = str.charCodeAt(index++) - 63;
+                    result += (b & 0x1f) * multiplier;
+                    multiplier *= 32;
+                } while (b >= 0x20);
+                values.push(result % 2 ? -(result + 1) / 2 : result / 2);
+            }
+            x += values[0];
+            y += values[1];
+            coords.push([x / factor, y / factor]);
+        }
+        return coords;
+    },
     multiGeometryClasses: {
         'linestring': OpenLayers.Geometry.MultiLineString,
         'point': OpenLayers.Geometry.MultiPoint,
@@ -187,6 +267,19 @@ var olwidget = {
         }
         return destination;
     },
+    isInViewport: function(el, margin) {
+        /* Is the element displayed, and within ``margin`` pixels of the
+         * viewport? */
+        if (!el.offsetWidth && !el.offsetHeight) {
+            return false;
+        }
+        var rect = el.getBoundingClientRect();
+        var height = window.innerHeight || document.documentElement.clientHeight;
+        var width = window.innerWidth || document.documentElement.clientWidth;
+        margin = margin || 0;
+        return rect.bottom >= -margin && rect.top <= height + margin &&
+               rect.right >= -margin && rect.left <= width + margin;
+    },
     isCollectionEmpty: function(geom) {
         /* Is the provided collection empty? */
         return !(geom && (geom.constructor != Array || geom[0] != undefined));
@@ -194,6 +287,54 @@ var olwidget = {
     _customBaseLayers: {},
     registerCustomBaseLayers: function(layer_descriptions) {
         OpenLayers.Util.extend(this._customBaseLayers, layer_descriptions);
+    },
+    registerCustomLayerTypes: function(types) {
+        /* Register layer types given as javascript constructor calls, as
+         * rendered by django-olwidget's ``CUSTOM_LAYER_TYPES``. */
+        for (var name in types) {
+            if (olwidget[name] === undefined) {
+                olwidget[name] = {
+                    map: new Function("return new " + types[name] + ";")
+                };
+            }
+        }
+    },
+    initMaps: function(root) {
+        /* Create maps for any JSON map data blocks, as rendered by
+         * django-olwidget's ``bootstrap`` option, found in ``root`` (by
+         * default, the whole document). */
+        var scripts = (root || document).getElementsByTagName("script");
+        var blocks = [];
+        for (var i = 0; i < scripts.length; i++) {
+            if (scripts[i].type == "application/json" &&
+                    scripts[i].className == "olwidgetMapData" &&
+                    !scripts[i].olwidgetMap) {
+                blocks.push(scripts[i]);
+            }
+        }
+        for (var i = 0; i < blocks.length; i++) {
+            var data = OpenLayers.Format.JSON.prototype.read(
+                blocks[i].text || blocks[i].innerHTML);
+            blocks[i].olwidgetMap = olwidget.mapFromData(data);
+        }
+    },
+    mapFromData: function(data) {
+        /* Create a map from a JSON map data object. */
+        olwidget.registerCustomLayerTypes(data.customLayerTypes || {});
+        var layers = [];
+        for (var i = 0; i < data.layers.length; i++) {
+            var layer = data.layers[i];
+            if (layer.type == "EditableLayer") {
+                layers.push(new olwidget.EditableLayer(layer.textareaId,
+                                                       layer.options));
+            } else {
+                layers.push(new olwidget[layer.type](layer.info,
+                                                     layer.options));
+            }
+        }
+        var map = new olwidget.Map(data.id, layers, data.options);
+        window["olwidget_" + data.id] = map;
+        return map;
     }
 };
 
@@ -204,7 +345,68 @@ olwidget.Map = OpenLayers.Class(OpenLayers.Map, {
     initialize: function(mapDivID, vectorLayers, options) {
         this.vectorLayers = vectorLayers;
         this.opts = this.initOptions(options);
-        this.initMap(mapDivID, this.opts);
+        if (this.opts.lazy) {
+            this.initLazy(mapDivID);
+        } else {
+            this.initMap(mapDivID, this.opts);
+        }
+    },
+    /*
+     * Defer building the map until its div is visible in the viewport.
+     * Until then, editable layers' textareas hold the data as usual.
+     */
+    initLazy: function(mapDivId) {
+        var mapDiv = document.getElementById(mapDivId);
+        // Reserve the map's space on the page.
+        OpenLayers.Util.extend(mapDiv.style, this.opts.mapDivStyle);
+        this.lazyDivId = mapDivId;
+
+        var map = this;
+        if (window.IntersectionObserver) {
+            this.lazyObserver = new IntersectionObserver(function(entries) {
+                for (var i = 0; i < entries.length; i++) {
+                    if (entries[i].isIntersecting) {
+                        map.build();
+                        return;
+                    }
+                }
+            }, {rootMargin: "200px"});
+            this.lazyObserver.observe(mapDiv);
+        } else {
+            // Check on scrolling, resizing, and clicks (which might expand a
+            // collapsed container).
+            this.lazyCheck = function() {
+                if (olwidget.isInViewport(mapDiv, 200)) {
+                    map.build();
+                }
+            };
+            this.lazyClick = function() {
+                window.setTimeout(map.lazyCheck, 0);
+            };
+            OpenLayers.Event.observe(window, "scroll", this.lazyCheck);
+            OpenLayers.Event.observe(window, "resize", this.lazyCheck);
+            OpenLayers.Event.observe(document, "click", this.lazyClick);
+            this.lazyCheck();
+        }
+    },
+    /*
+     * Build a lazy map now, if it hasn't been built yet.
+     */
+    build: function() {
+        if (!this.lazyDivId) {
+            return;
+        }
+        var mapDivId = this.lazyDivId;
+        this.lazyDivId = null;
+        if (this.lazyObserver) {
+            this.lazyObserver.disconnect();
+            this.lazyObserver = null;
+        } else {
+            OpenLayers.Event.stopObserving(window, "scroll", this.lazyCheck);
+            OpenLayers.Event.stopObserving(window, "resize", this.lazyCheck);
+            OpenLayers.Event.stopObserving(document, "click", this.lazyClick);
+        }
+        this.initMap(mapDivId, this.opts);
     },
     /*
      * Extend the passed in options with defaults, and create unserialized
@@ -412,29 +614,48 @@ olwidget.Map = OpenLayers.Class(OpenLayers.Map, {
 
         var popupHTML = [];
         if (feature.cluster) {
-            if (feature.layer && feature.layer.opts &&
-                    feature.layer.opts.clusterDisplay == 'list') {
-                if (feature.cluster.length > 1) {
-                    var html = "<ul class='olwidgetClusterList'>";
-                    for (var i = 0; i < feature.cluster.length; i++) {
-                        html += "<li>" + feature.cluster[i].attributes.html +
-                            "</li>";
-                    }
-                    html += "</ul>";
-                    popupHTML.push(html);
-                } else {
-                    popupHTML.push(feature.cluster[0].attributes.html);
-                }
-            } else {
-                for (var i = 0; i < feature.cluster.length; i++) {
-                    popupHTML.push(feature.cluster[i].attributes.html);
-                }
+            var clusterHTML = [];
+            for (var i = 0; i < feature.cluster.length; i++) {
+                clusterHTML.push(feature.cluster[i].attributes.html);
             }
+            popupHTML = this.clusterPopupHTML(feature.layer, clusterHTML);
+        } else if (feature.attributes.clusterStart !== undefined) {
+            // A server side cluster, whose members' html may need fetching.
+            var map = this;
+            feature.layer.getClusterHTML(feature, function(clusterHTML) {
+                // Skip if the feature was unselected or replaced meanwhile.
+                if (feature.layer && OpenLayers.Util.indexOf(
+                        feature.layer.selectedFeatures, feature) != -1) {
+                    map.showPopup(feature, lonlat,
+                        map.clusterPopupHTML(feature.layer, clusterHTML));
+                }
+            });
+            return;
         } else {
             if (feature.attributes.html) {
                 popupHTML.push(feature.attributes.html);
             }
         }
+        this.showPopup(feature, lonlat, popupHTML);
+    },
+    /**
+     * Return the popup pages for the html of a cluster's members
+     */
+    clusterPopupHTML: function(layer, clusterHTML) {
+        if (layer && layer.opts && layer.opts.clusterDisplay == 'list') {
+            if (clusterHTML.length > 1) {
+                var html = "<ul class='olwidgetClusterList'>";
+                for (var i = 0; i < clusterHTML.length; i++) {
+                    html += "<li>" + clusterHTML[i] + "</li>";
+                }
+                html += "</ul>";
+                return [html];
+            }
+            return [clusterHTML[0]];
+        }
+        return clusterHTML;
+    },
+    showPopup: function(feature, lonlat, popupHTML) {
         if (popupHTML.length > 0) {
             var infomap = this;
             var popup = new olwidget.Popup(null,
@@ -521,7 +742,7 @@ olwidget.InfoLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
         this.info = info;
     },
     setMap: function(map) {
-        if (this.opts.cluster || map.opts.cluster) {
+        if (this.opts.cluster || map.opts.cluster || this.isServerClustered()) {
             // Use a different default style if we are clustering.
             var clusterStyle = {
                 pointRadius: "${radius}",
@@ -538,7 +759,7 @@ olwidget.InfoLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
                 {}, clusterStyle);
             this.defaultOpts.overlayStyleContext = {
                 width: function(feature) {
-                    return (feature.cluster) ? 2 : 1;
+                    return (feature.cluster || feature.attributes.count > 1) ? 2 : 1;
                 },
                 radius: function(feature) {
                     var n = feature.attributes.count;
@@ -560,6 +781,10 @@ olwidget.InfoLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
                     if (feature.cluster && feature.cluster.length > 1) {
                         return feature.cluster.length;
                     }
+                    if (feature.attributes.clusterStart !== undefined &&
+                            feature.attributes.count > 1) {
+                        return feature.attributes.count;
+                    }
                     return '';
                 }
             };
@@ -577,12 +802,134 @@ olwidget.InfoLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
             this.strategies.push(cluster);
             cluster.activate();
         }
+        // Fetch info for the viewport as the map moves.
+        if (this.opts.bboxUrl) {
+            if (!this.strategies) {
+                this.strategies = [];
+            }
+            this.protocol = new olwidget.InfoProtocol({
+                url: this.opts.bboxUrl,
+                layer: this
+            });
+            var bbox = new olwidget.BBOXStrategy({
+                maxRatio: this.opts.bboxRatio || 1.5
+            });
+            bbox.setLayer(this);
+            this.strategies.push(bbox);
+            bbox.activate();
+        }
+        // Fetch info one tile at a time as the map moves.
+        if (this.opts.tileUrl) {
+            if (!this.strategies) {
+                this.strategies = [];
+            }
+            var tiles = new olwidget.TileStrategy({url: this.opts.tileUrl});
+            tiles.setLayer(this);
+            this.strategies.push(tiles);
+            tiles.activate();
+        }
     },
     afterAdd: function() {
         olwidget.BaseVectorLayer.prototype.afterAdd.apply(this);
+        if (this.isServerClustered()) {
+            this.showServerClusters();
+            this.map.events.register("zoomend", this, this.showServerClusters);
+            return;
+        }
+        this.infoFeatures = this.infoToFeatures(this.info);
+        this.addFeatures(this.infoFeatures);
+        if (this.opts.dataUrl && this.opts.dataNext !== undefined &&
+                this.opts.dataNext !== null) {
+            this.loadData(this.opts.dataNext);
+        }
+    },
+    /*
+     * Is the info clustered per zoom level, as written by django-olwidget's
+     * ``server_cluster`` option?  The info is then an object with
+     * "zooms", an array of {"x": [...], "y": [...], "count": [...]} cluster
+     * columns for each zoom level from 0, in the projection "srid", and
+     * either "html" or "keys" with one entry per geometry.  Clusters list
+     * their members in order, so that each cluster's members follow those of
+     * the clusters before it.
+     */
+    isServerClustered: function() {
+        return Boolean(this.info && this.info.zooms);
+    },
+    showServerClusters: function() {
+        var zooms = this.info.zooms;
+        var level = Math.max(0, Math.min(this.map.getZoom() || 0,
+                                         zooms.length - 1));
+        if (level === this.serverClusterLevel) {
+            return;
+        }
+        this.serverClusterLevel = level;
+        var clusters = zooms[level];
+        var proj = new OpenLayers.Projection("EPSG:" + this.info.srid);
+        var reproject = !proj.equals(this.map.projection);
+        var features = [];
+        var start = 0;
+        for (var i = 0; i < clusters.count.length; i++) {
+            var geometry = new OpenLayers.Geometry.Point(clusters.x[i],
+                                                         clusters.y[i]);
+            if (reproject) {
+                geometry.transform(proj, this.map.projection);
+            }
+            features.push(new OpenLayers.Feature.Vector(geometry, {
+                count: clusters.count[i],
+                clusterStart: start
+            }));
+            start += clusters.count[i];
+        }
+        this.destroyFeatures();
+        this.addFeatures(features);
+    },
+    /*
+     * Pass the html of a server side cluster's members to callback, fetching
+     * it from opts.clusterHtmlUrl if it isn't included in the info.  Only
+     * the first opts.clusterHtmlLimit members are fetched; the rest are
+     * summarized.
+     */
+    getClusterHTML: function(feature, callback) {
+        var start = feature.attributes.clusterStart;
+        var end = start + feature.attributes.count;
+        if (this.info.html) {
+            callback(this.info.html.slice(start, end));
+            return;
+        }
+        var more = 0;
+        if (this.opts.clusterHtmlLimit &&
+                end - start > this.opts.clusterHtmlLimit) {
+            more = end - start - this.opts.clusterHtmlLimit;
+            end = start + this.opts.clusterHtmlLimit;
+        }
+        OpenLayers.Request.GET({
+            url: this.opts.clusterHtmlUrl,
+            params: {keys: this.info.keys.slice(start, end).join(",")},
+            success: function(response) {
+                var html = new OpenLayers.Format.JSON().read(
+                    response.responseText);
+                if (html) {
+                    if (more) {
+                        html.push("<p class='olwidgetClusterMore'>and " +
+                                  more + " more</p>");
+                    }
+                    callback(html);
+                }
+            }
+        });
+    },
+    /*
+     * Convert an array of [ewkt, html] pairs into vector features in the
+     * map's projection.
+     */
+    infoToFeatures: function(info) {
+        if (info && info.x) {
+            return this.columnsToFeatures(info);
+        }
         var features = [];
-        for (var i = 0; i < this.info.length; i++) {
-            var feature = olwidget.ewktToFeature(this.info[i][0]);
+        for (var i = 0; i < info.length; i++) {
+            var feature = olwidget.decodeGeometry(info[i][0],
+                this.opts.geometryEncoding, this.opts.precision);
             if (olwidget.isCollectionEmpty(feature)) {
                 continue;
             }
@@ -592,30 +939,304 @@ olwidget.InfoLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
             if (feature.constructor != Array) {
                 feature = [feature];
             }
-            var htmlInfo = this.info[i][1];
             for (var k = 0; k < feature.length; k++) {
-                if (typeof htmlInfo === "object") {
-                    feature[k].attributes = htmlInfo;
-                    if (typeof htmlInfo.style !== "undefined") {
-                        feature[k].style = OpenLayers.Util.applyDefaults(
-                            htmlInfo.style, this.opts.overlayStyle
-                        );
-                    }
-                } else {
-                    feature[k].attributes = { html: htmlInfo };
-                }
+                this.setInfoAttributes(feature[k], info[i][1]);
                 features.push(feature[k]);
             }
         }
-        this.addFeatures(features);
+        return features;
+    },
+    /*
+     * Convert columnar info, as written by django-olwidget's
+     * ColumnarInfoLayer, into vector features in the map's projection.
+     * Columnar info is an object with "x" and "y" coordinate arrays in the
+     * projection "srid", and optionally "html" with each feature's popup
+     * html.  Features are points, unless "offsets" gives the index of each
+     * linestring's first vertex (plus the total number of vertices).
+     */
+    columnsToFeatures: function(data) {
+        var proj = new OpenLayers.Projection("EPSG:" + data.srid);
+        var reproject = !proj.equals(this.map.projection);
+        var count = data.offsets ? data.offsets.length - 1 : data.x.length;
+        var features = [];
+        for (var i = 0; i < count; i++) {
+            var geometry;
+            if (data.offsets) {
+                var points = [];
+                for (var j = data.offsets[i]; j < data.offsets[i + 1]; j++) {
+                    points.push(new OpenLayers.Geometry.Point(
+                        data.x[j], data.y[j]));
+                }
+                geometry = new OpenLayers.Geometry.LineString(points);
+            } else {
+                geometry = new OpenLayers.Geometry.Point(data.x[i], data.y[i]);
+            }
+            if (reproject) {
+                geometry.transform(proj, this.map.projection);
+            }
+            var feature = new OpenLayers.Feature.Vector(geometry);
+            this.setInfoAttributes(feature, data.html ? data.html[i] : "");
+            features.push(feature);
+        }
+        return features;
+    },
+    setInfoAttributes: function(feature, htmlInfo) {
+        if (typeof htmlInfo === "object") {
+            feature.attributes = htmlInfo;
+            if (typeof htmlInfo.style !== "undefined") {
+                feature.style = OpenLayers.Util.applyDefaults(
+                    htmlInfo.style, this.opts.overlayStyle
+                );
+            }
+        } else {
+            feature.attributes = { html: htmlInfo };
+        }
+    },
+    /*
+     * Fetch the chunk of info following the cursor `after` from
+     * opts.dataUrl, add it to the layer, and continue until the server
+     * reports no more data.
+     */
+    loadData: function(after) {
+        var layer = this;
+        OpenLayers.Request.GET({
+            url: this.opts.dataUrl,
+            params: {after: after},
+            success: function(response) {
+                if (!layer.map) {
+                    return;
+                }
+                var data = new OpenLayers.Format.JSON().read(
+                    response.responseText);
+                if (!data) {
+                    return;
+                }
+                var features = layer.infoToFeatures(data.info);
+                layer.infoFeatures = layer.infoFeatures.concat(features);
+                if (layer.opts.cluster) {
+                    // The cluster strategy only clusters the features of the
+                    // most recent add, so re-add everything.
+                    layer.removeAllFeatures();
+                    layer.addFeatures(layer.infoFeatures);
+                } else {
+                    layer.addFeatures(features);
+                }
+                if (data.next !== null && data.next !== undefined) {
+                    layer.loadData(data.next);
+                }
+            }
+        });
     },
     CLASS_NAME: "olwidget.InfoLayer"
 });
 
+/*
+ * Protocol for olwidget.InfoLayer's bboxUrl option, which reads info for the
+ * bounds of an OpenLayers.Strategy.BBOX.
+ */
+olwidget.InfoProtocol = OpenLayers.Class(OpenLayers.Protocol, {
+    read: function(options) {
+        options = OpenLayers.Util.applyDefaults(options, this.options);
+        var layer = this.layer;
+        // The bounds are in the map's projection, which the server
+        // transforms them from.
+        var bounds = options.filter.value;
+        var response = new OpenLayers.Protocol.Response({requestType: "read"});
+        response.priv = OpenLayers.Request.GET({
+            url: this.url,
+            params: {
+                bbox: bounds.toBBOX(),
+                srid: layer.map.getProjectionObject().getCode().split(":")[1],
+                zoom: layer.map.getZoom()
+            },
+            callback: function(request) {
+                var data = null;
+                if (request.status >= 200 && request.status < 300) {
+                    data = new OpenLayers.Format.JSON().read(
+                        request.responseText);
+                }
+                if (data) {
+                    response.features = layer.infoToFeatures(data.info);
+                    response.truncated = data.truncated;
+                    response.code = OpenLayers.Protocol.Response.SUCCESS;
+                } else {
+                    response.features = [];
+                    response.code = OpenLayers.Protocol.Response.FAILURE;
+                }
+                options.callback.call(options.scope, response);
+            }
+        });
+        return response;
+    },
+    abort: function(response) {
+        if (response && response.priv) {
+            response.priv.abort();
+        }
+    },
+    CLASS_NAME: "olwidget.InfoProtocol"
+});
+
+/*
+ * BBOX strategy for olwidget.InfoLayer's bboxUrl option.  The margin loaded
+ * around the viewport grows with the zoom level, up to maxRatio at the
+ * deepest level, so that zoomed out maps don't request much of the world
+ * beyond what is in view.
+ */
+olwidget.BBOXStrategy = OpenLayers.Class(OpenLayers.Strategy.BBOX, {
+    maxRatio: 1.5,
+    getMapBounds: function() {
+        var map = this.layer.map;
+        var levels = map.getNumZoomLevels();
+        var scale = levels > 1 ? (map.getZoom() || 0) / (levels - 1) : 1;
+        this.ratio = 1 + (this.maxRatio - 1) * Math.min(1, scale);
+        return OpenLayers.Strategy.BBOX.prototype.getMapBounds.apply(this,
+                                                                     arguments);
+    },
+    CLASS_NAME: "olwidget.BBOXStrategy"
+});
+
+/*
+ * Strategy for olwidget.InfoLayer's tileUrl option, which loads info for
+ * each spherical mercator tile in view at the zoom level closest to the
+ * map's.  Tiles are requested from the url with "{z}", "{x}" and "{y}"
+ * replaced, and their responses should be a JSON object
+ * {"info": [[geom, html], ...], "ids": [...]}, where ids identify each
+ * entry so that objects spanning several tiles are only added once.
+ */
+olwidget.TileStrategy = OpenLayers.Class(OpenLayers.Strategy, {
+    url: null,
+    tileSize: 256,
+    maxExtent: 20037508.342789244,
+    zoom: null,
+    tiles: null,
+    ids: null,
+    activate: function() {
+        var activated = OpenLayers.Strategy.prototype.activate.call(this);
+        if (activated) {
+            this.tiles = {};
+            this.ids = {};
+            this.layer.events.on({moveend: this.update, scope: this});
+            if (this.layer.map) {
+                this.update();
+            }
+        }
+        return activated;
+    },
+    deactivate: function() {
+        var deactivated = OpenLayers.Strategy.prototype.deactivate.call(this);
+        if (deactivated) {
+            this.layer.events.un({moveend: this.update, scope: this});
+            this.abort();
+        }
+        return deactivated;
+    },
+    abort: function() {
+        for (var key in this.tiles) {
+            if (this.tiles[key] !== true) {
+                this.tiles[key].abort();
+            }
+        }
+        this.tiles = {};
+    },
+    update: function() {
+        var map = this.layer.map;
+        var extent = map.getExtent();
+        if (!extent) {
+            return;
+        }
+        extent = extent.clone().transform(map.projection,
+            new OpenLayers.Projection("EPSG:900913"));
+        var resolution = extent.getWidth() / map.getSize().w;
+        var zoom = Math.round(Math.log(
+            2 * this.maxExtent / this.tileSize / resolution) / Math.LN2);
+        zoom = Math.max(0, zoom);
+        if (zoom !== this.zoom) {
+            // Tiles are simplified for their zoom level, so start over.
+            this.abort();
+            this.ids = {};
+            this.layer.infoFeatures = [];
+            this.layer.destroyFeatures();
+            this.zoom = zoom;
+        }
+        var count = Math.pow(2, zoom);
+        var size = 2 * this.maxExtent / count;
+        var clamp = function(value) {
+            return Math.max(0, Math.min(count - 1, Math.floor(value)));
+        };
+        var left = clamp((extent.left + this.maxExtent) / size);
+        var right = clamp((extent.right + this.maxExtent) / size);
+        var top = clamp((this.maxExtent - extent.top) / size);
+        var bottom = clamp((this.maxExtent - extent.bottom) / size);
+        for (var x = left; x <= right; x++) {
+            for (var y = top; y <= bottom; y++) {
+                var key = zoom + "/" + x + "/" + y;
+                if (!this.tiles[key]) {
+                    this.tiles[key] = this.loadTile(zoom, x, y, key);
+                }
+            }
+        }
+    },
+    loadTile: function(zoom, x, y, key) {
+        var strategy = this;
+        var url = this.url.replace("{z}", zoom).replace("{x}", x)
+                          .replace("{y}", y);
+        return OpenLayers.Request.GET({
+            url: url,
+            success: function(response) {
+                if (strategy.zoom !== zoom || !strategy.layer.map) {
+                    return;
+                }
+                var data = new OpenLayers.Format.JSON().read(
+                    response.responseText);
+                if (data) {
+                    strategy.tiles[key] = true;
+                    strategy.addInfo(data);
+                } else {
+                    delete strategy.tiles[key];
+                }
+            },
+            failure: function(response) {
+                // Forget the tile, so that it's requested again when it
+                // next comes into view, unless it already has been.
+                if (strategy.tiles[key] === response) {
+                    delete strategy.tiles[key];
+                }
+            }
+        });
+    },
+    addInfo: function(data) {
+        var info = [];
+        for (var i = 0; i < data.info.length; i++) {
+            if (data.ids) {
+                if (this.ids[data.ids[i]]) {
+                    continue;
+                }
+                this.ids[data.ids[i]] = true;
+            }
+            info.push(data.info[i]);
+        }
+        var layer = this.layer;
+        var features = layer.infoToFeatures(info);
+        layer.infoFeatures = layer.infoFeatures.concat(features);
+        if (layer.opts.cluster) {
+            // As in loadData, re-add everything to recluster.
+            layer.removeAllFeatures();
+            layer.addFeatures(layer.infoFeatures);
+        } else {
+            layer.addFeatures(features);
+        }
+    },
+    CLASS_NAME: "olwidget.TileStrategy"
+});
+
 olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
     undoStack: null,
     undoStackPos: null,
     undoStackLength: 1000,
+    // With the deltaSubmit option, the features of the geometry the layer
+    // started with, each with its "deltaIndex".
+    deltaBase: null,
+    deltaPrefix: "DELTA;",
 
     initialize: function(textareaId, options) {
         olwidget.BaseVectorLayer.prototype.initialize.apply(this,
@@ -637,10 +1258,110 @@ olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
             this.textarea.style.display = 'none';
         }
         this.buildControls();
+        if (this.opts.deltaSubmit && this.opts.isCollection) {
+            this.initDelta();
+        }
         this.readWKT();
         // init undo stack
         this.addUndoState();
     },
+    /*
+     * With the deltaSubmit option, the textarea holds only the changes to
+     * the components of the collection since the page was loaded, as
+     * "DELTA;" followed by a JSON object:
+     *
+     *   {"srid": 4326, "type": "MULTIPOLYGON", "base": <base digest>,
+     *    "size": <base components>, "modified": {"<index>": wkt, ...},
+     *    "added": [wkt, ...], "deleted": [index, ...]}
+     *
+     * Components are numbered by their position in the base geometry, which
+     * is the textarea's initial value, or opts.deltaBase when submitted
+     * changes are redisplayed.  opts.deltaBaseDigest identifies the base
+     * geometry to the server, which rejects changes made to another one.
+     */
+    initDelta: function() {
+        var value = this.textarea.value;
+        var base = value;
+        if (value.indexOf(this.deltaPrefix) === 0) {
+            base = this.opts.deltaBase || "";
+        }
+        this.deltaBase = this.wktToFeatures(base);
+        for (var i = 0; i < this.deltaBase.length; i++) {
+            this.deltaBase[i].deltaIndex = i;
+        }
+        if (value.indexOf(this.deltaPrefix) !== 0) {
+            this.textarea.value = this.featuresToDelta(this.deltaBase);
+        }
+    },
+    featuresToDelta: function(features) {
+        var type = "GEOMETRYCOLLECTION";
+        if (this.opts.geometry.constructor != Array) {
+            type = "MULTI" + this.opts.geometry.toUpperCase();
+        }
+        var delta = {
+            srid: parseInt(this.map.displayProjection.projCode.substring(5)),
+            type: type,
+            base: this.opts.deltaBaseDigest,
+            size: this.deltaBase.length,
+            modified: {},
+            added: [],
+            deleted: []
+        };
+        var seen = {};
+        for (var i = 0; i < features.length; i++) {
+            var feature = features[i];
+            if (feature.deltaIndex === undefined) {
+                delta.added.push(this.componentToWKT(feature));
+            } else {
+                seen[feature.deltaIndex] = true;
+                if (feature.deltaModified) {
+                    delta.modified[feature.deltaIndex] =
+                        this.componentToWKT(feature);
+                }
+            }
+        }
+        for (var j = 0; j < this.deltaBase.length; j++) {
+            if (!seen[j]) {
+                delta.deleted.push(j);
+            }
+        }
+        return this.deltaPrefix + new OpenLayers.Format.JSON().write(delta);
+    },
+    deltaToFeatures: function(value) {
+        var delta = new OpenLayers.Format.JSON().read(
+            value.substring(this.deltaPrefix.length)) || {};
+        var modified = delta.modified || {};
+        var deleted = {};
+        var i;
+        for (i = 0; i < (delta.deleted || []).length; i++) {
+            deleted[delta.deleted[i]] = true;
+        }
+        var features = [];
+        for (i = 0; i < this.deltaBase.length; i++) {
+            if (deleted[i]) {
+                continue;
+            }
+            var feature;
+            if (modified[i] !== undefined) {
+                feature = this.wktToFeatures(modified[i])[0];
+                feature.deltaModified = true;
+            } else {
+                // Copy, so that edits leave the base alone.
+                feature = new OpenLayers.Feature.Vector(
+                    this.deltaBase[i].geometry.clone());
+            }
+            feature.deltaIndex = i;
+            features.push(feature);
+        }
+        for (i = 0; i < (delta.added || []).length; i++) {
+            features = features.concat(this.wktToFeatures(delta.added[i]));
+        }
+        return features;
+    },
+    componentToWKT: function(feature) {
+        return olwidget.wktFormat.write(olwidget.transformVector(feature,
+            this.map.projection, this.map.displayProjection));
+    },
     _addDrawFeature: function(obj_type, obj_options, controls) {
         var drawControl = new OpenLayers.Control.DrawFeature(
             this, obj_type, obj_options);
@@ -763,8 +1484,9 @@ olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
     clearFeatures: function() {
         this.removeFeatures(this.features);
         this.destroyFeatures();
-        if (this.textarea.value !== "") {
-            this.textarea.value = "";
+        var value = this.deltaBase ? this.featuresToDelta([]) : "";
+        if (this.textarea.value !== value) {
+            this.textarea.value = value;
             this.addUndoState();
         }
     },
@@ -823,42 +1545,51 @@ olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
         if (this.features) {
             this.removeFeatures(this.features);
         }
-        if (wkt) {
-            var geom = olwidget.ewktToFeature(wkt);
-            if (!olwidget.isCollectionEmpty(geom)) {
-                geom = olwidget.transformVector(geom,
-                    this.map.displayProjection,
-                    this.map.projection);
-                if (geom.constructor == Array ||
-                        geom.geometry.CLASS_NAME ===
-                                "OpenLayers.Geometry.MultiLineString" ||
-                        geom.geometry.CLASS_NAME ===
-                                "OpenLayers.Geometry.MultiPoint" ||
-                        geom.geometry.CLASS_NAME ===
-                                "OpenLayers.Geometry.MultiPolygon") {
-                    // extract geometries from MULTI<geom> types into
-                    // individual components (keeps the vector layer flat)
-                    if (geom.geometry != undefined) {
-                        var geoms = [];
-                        var n = geom.geometry.components.length;
-                        for (var i = 0; i < n; i++) {
-                            geoms.push(
-                                new OpenLayers.Feature.Vector(
-                                    geom.geometry.components[i])
-                            );
-                        }
-                        this.addFeatures(geoms, {silent: true});
-                    } else {
-                        this.addFeatures(geom, {silent: true});
-                    }
-                } else {
-                    this.addFeatures([geom], {silent: true});
-                }
-                this.numGeom = this.features.length;
-            } else {
-                this.numGeom = 0;
+        if (this.deltaBase) {
+            var features = this.deltaToFeatures(wkt);
+            this.addFeatures(features, {silent: true});
+            this.numGeom = features.length;
+        } else if (wkt) {
+            var geoms = this.wktToFeatures(wkt);
+            this.addFeatures(geoms, {silent: true});
+            this.numGeom = geoms.length;
+        }
+    },
+    wktToFeatures: function(wkt) {
+        // Return the features for WKT in the "displayProjection", in the
+        // map's projection, with collections split into their components.
+        if (!wkt) {
+            return [];
+        }
+        var geom = olwidget.ewktToFeature(wkt);
+        if (olwidget.isCollectionEmpty(geom)) {
+            return [];
+        }
+        geom = olwidget.transformVector(geom,
+            this.map.displayProjection,
+            this.map.projection);
+        if (geom.constructor == Array) {
+            return geom;
+        }
+        if (geom.geometry.CLASS_NAME ===
+                    "OpenLayers.Geometry.MultiLineString" ||
+                geom.geometry.CLASS_NAME ===
+                    "OpenLayers.Geometry.MultiPoint" ||
+                geom.geometry.CLASS_NAME ===
+                    "OpenLayers.Geometry.MultiPolygon") {
+            // extract geometries from MULTI<geom> types into
+            // individual components (keeps the vector layer flat)
+            var geoms = [];
+            var n = geom.geometry.components.length;
+            for (var i = 0; i < n; i++) {
+                geoms.push(
+                    new OpenLayers.Feature.Vector(
+                        geom.geometry.components[i])
+                );
             }
+            return geoms;
         }
+        return [geom];
     },
     // Callback for openlayers "featureadded"
     addWKT: function(event) {
@@ -885,7 +1616,15 @@ olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
             // of features counted when we last added.
             var feat = [];
             for (var i = 0; i < Math.min(this.numGeom, this.features.length); i++) {
-                feat.push(this.features[i].clone());
+                if (this.deltaBase) {
+                    // Keep the features' deltaIndex.
+                    feat.push(this.features[i]);
+                } else {
+                    feat.push(this.features[i].clone());
+                }
+            }
+            if (event.feature) {
+                event.feature.deltaModified = true;
             }
             this.featureToTextarea(feat);
         } else {
@@ -903,6 +1642,10 @@ olwidget.EditableLayer = OpenLayers.Class(olwidget.BaseVectorLayer, {
         } else {
             this.numGeom = 1;
         }
+        if (this.deltaBase) {
+            this.textarea.value = this.featuresToDelta(feature);
+            return;
+        }
         feature = olwidget.transformVector(feature,
                 this.map.projection, this.map.displayProjection);
         if (this.opts.isCollection) {
@@ -1638,4 +2381,15 @@ olwidget.DeleteVertex = OpenLayers.Class(OpenLayers.Control.ModifyFeature, {
 });
 
 window.olwidget = olwidget;
+
+// Initialize any JSON map data blocks once the page has loaded.
+if (document.addEventListener) {
+    document.addEventListener("DOMContentLoaded", function() {
+        olwidget.initMaps();
+    }, false);
+} else {
+    OpenLayers.Event.observe(window, "load", function() {
+        olwidget.initMaps();
+    });
+}
 })();